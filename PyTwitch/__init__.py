@@ -1,5 +1,29 @@
 """
 The Bot lib it self
+
+The submodules are imported the first time they are used,
+so tools that only need the parser do not pay for the api client.
 """
+import importlib
+from typing import Any, Dict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .twitch_bot import TwitchBot  # noqa
+    from .twitch_api import TwitchApi  # noqa
+
+_LAZY_ATTRIBUTES: Dict[str, str] = {
+        "TwitchBot": "twitch_bot",
+        "TwitchApi": "twitch_api",
+        }
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-from .twitch_bot import TwitchBot # noqa
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
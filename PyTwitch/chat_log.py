@@ -0,0 +1,302 @@
+"""
+A compact append only log of chat, for moderation review, replay and benchmarks.
+
+Chat is written to numbered segment files as length prefixed records holding the time
+it was received and the raw irc line. Every segment has a sidecar index with a fixed size
+entry per record, holding its time, offset and a hash of its channel and user, so the
+reader can find records by channel, user and time without decoding the others.
+
+bot.record_chat("chatlogs")
+
+reader = ChatLogReader("chatlogs")
+for timestamp, line in reader.records(channel="vivax3794", start=time.time() - 3600):
+    print(line)
+"""
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Any, BinaryIO, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .data_types import Message  # noqa
+    from .twitch_core import TwitchCore  # noqa
+
+SEGMENT_MAGIC = b"PTCHAT1\n"
+# timestamp, length of the line
+RECORD_HEADER = struct.Struct("<dI")
+# timestamp, offset of the record in the segment, crc32 of the channel, crc32 of the user
+INDEX_ENTRY = struct.Struct("<dQII")
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def name_hash(name: str) -> int:
+    """
+    The hash of a channel or user name stored in the index.
+    """
+    return zlib.crc32(name.lower().encode())
+
+
+def _line_names(line: str) -> Tuple[str, str]:
+    """
+    The channel and user of a chat line, without parsing the rest of it.
+    """
+    if line.startswith("@"):
+        line = line.split(" ", 1)[1]
+    prefix, _, rest = line.partition(" PRIVMSG #")
+    return rest.split(" ", 1)[0], prefix[1:].split("!", 1)[0]
+
+
+def _names_match(line: str, channel: Optional[str], user: Optional[str]) -> bool:
+    if channel is None and user is None:
+        return True
+
+    line_channel, line_user = _line_names(line)
+    if channel is not None and line_channel.lower() != channel.lower():
+        return False
+    return user is None or line_user.lower() == user.lower()
+
+
+class ChatRecorder:
+    """
+    Writes chat to a directory of segments, starting a new one once a segment reaches segment_size bytes.
+
+    Writes are buffered, call flush to make sure readers see everything.
+    """
+    def __init__(self, directory: str, segment_size: int = DEFAULT_SEGMENT_SIZE, prefix: str = "chat") -> None:
+        if segment_size <= len(SEGMENT_MAGIC):
+            raise ValueError("segment_size is too small")
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.prefix = prefix
+        os.makedirs(directory, exist_ok=True)
+
+        # continue after the segments already there, they are never appended to
+        existing = _segment_numbers(directory, prefix)
+        self._segment_number = existing[-1] if existing else 0
+        self._segment: Optional[BinaryIO] = None
+        self._index: Optional[BinaryIO] = None
+        self._offset = 0
+
+    def record(self,
+               line: str,
+               channel: Optional[str] = None,
+               user: Optional[str] = None,
+               timestamp: Optional[float] = None
+               ) -> None:
+        """
+        Append a raw irc line, the channel and user are read from the line if not given.
+        """
+        if channel is None or user is None:
+            channel, user = _line_names(line)
+        if timestamp is None:
+            timestamp = time.time()
+
+        data = line.encode()
+        if self._segment is None or self._offset + RECORD_HEADER.size + len(data) > self.segment_size:
+            self._rotate()
+
+        self._segment.write(RECORD_HEADER.pack(timestamp, len(data)) + data)  # type: ignore
+        self._index.write(INDEX_ENTRY.pack(timestamp, self._offset, name_hash(channel), name_hash(user)))  # type: ignore
+        self._offset += RECORD_HEADER.size + len(data)
+
+    def _rotate(self) -> None:
+        self.close()
+        self._segment_number += 1
+        path = _segment_path(self.directory, self.prefix, self._segment_number)
+        # readers find segments by their .log file, so the index has to exist by then,
+        # and the magic is written out right away so the new segment can be read
+        self._index = open(path[:-len(".log")] + ".idx", "wb")
+        self._segment = open(path, "wb")
+        self._segment.write(SEGMENT_MAGIC)
+        self._segment.flush()
+        self._offset = len(SEGMENT_MAGIC)
+
+    def flush(self) -> None:
+        # the index is flushed last, so a reader never finds a entry before its record
+        if self._segment is not None and self._index is not None:
+            self._segment.flush()
+            self._index.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._segment is not None and self._index is not None:
+            self._segment.close()
+            self._index.close()
+        self._segment = None
+        self._index = None
+
+
+def _segment_path(directory: str, prefix: str, number: int) -> str:
+    return os.path.join(directory, f"{prefix}-{number:06d}.log")
+
+
+def _segment_numbers(directory: str, prefix: str) -> List[int]:
+    numbers: List[int] = []
+    for file_name in os.listdir(directory):
+        name, extension = os.path.splitext(file_name)
+        if extension == ".log" and name.startswith(prefix + "-") and name[len(prefix) + 1:].isdigit():
+            numbers.append(int(name[len(prefix) + 1:]))
+    return sorted(numbers)
+
+
+class _Segment:
+    """
+    A memory mapped segment and its index.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # the index is mapped first, the records it points to were flushed before it
+        self.index = _map_file(path[:-len(".log")] + ".idx")
+        self.data = _map_file(path)
+
+        if self.data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a chat log segment")
+
+        # a index being written can end in a partial entry, or in entries whose records
+        # were flushed after the data was mapped
+        self.entries = len(self.index) // INDEX_ENTRY.size
+        while self.entries and not self._record_fits(self.entries - 1):
+            self.entries -= 1
+
+    def _record_fits(self, entry: int) -> bool:
+        offset = INDEX_ENTRY.unpack_from(self.index, entry * INDEX_ENTRY.size)[1]
+        if offset + RECORD_HEADER.size > len(self.data):
+            return False
+        _, length = RECORD_HEADER.unpack_from(self.data, offset)
+        return bool(offset + RECORD_HEADER.size + length <= len(self.data))
+
+    def timestamp(self, entry: int) -> float:
+        timestamp: float = INDEX_ENTRY.unpack_from(self.index, entry * INDEX_ENTRY.size)[0]
+        return timestamp
+
+    def first_entry(self, start: Optional[float]) -> int:
+        """
+        The first entry at or after start, the timestamps only go up within a segment.
+        """
+        low, high = 0, self.entries
+        if start is None:
+            return low
+
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self,
+             channel_hash: Optional[int],
+             user_hash: Optional[int],
+             start: Optional[float],
+             end: Optional[float]
+             ) -> Iterator[Tuple[float, int]]:
+        """
+        The time and offset of the records matching the filters, only looking at the index.
+        """
+        if self.entries == 0 or (end is not None and self.timestamp(0) >= end):
+            return
+        if start is not None and self.timestamp(self.entries - 1) < start:
+            return
+
+        first = self.first_entry(start)
+        index = self.index[first * INDEX_ENTRY.size:self.entries * INDEX_ENTRY.size]
+        for timestamp, offset, entry_channel, entry_user in INDEX_ENTRY.iter_unpack(index):
+            if end is not None and timestamp >= end:
+                return
+            if channel_hash is not None and entry_channel != channel_hash:
+                continue
+            if user_hash is not None and entry_user != user_hash:
+                continue
+            yield timestamp, offset
+
+    def line(self, offset: int) -> str:
+        _, length = RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        return self.data[start:start + length].decode("utf8", "replace")
+
+    def close(self) -> None:
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
+def _being_created(path: str) -> bool:
+    """
+    Check if a recorder is still creating a segment, its magic or index may not be there yet.
+    """
+    try:
+        return os.path.getsize(path) < len(SEGMENT_MAGIC) or not os.path.exists(path[:-len(".log")] + ".idx")
+    except OSError:
+        return True
+
+
+def _map_file(path: str) -> Union[mmap.mmap, bytes]:
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped
+            return b""
+
+
+class ChatLogReader:
+    """
+    Reads the segments written by a ChatRecorder.
+    """
+    def __init__(self, directory: str, prefix: str = "chat") -> None:
+        self.directory = directory
+        self.prefix = prefix
+
+    def segments(self) -> List[str]:
+        return [_segment_path(self.directory, self.prefix, number)
+                for number in _segment_numbers(self.directory, self.prefix)]
+
+    def records(self,
+                channel: Optional[str] = None,
+                user: Optional[str] = None,
+                start: Optional[float] = None,
+                end: Optional[float] = None
+                ) -> Iterator[Tuple[float, str]]:
+        """
+        The time and raw line of every record matching the filters, oldest first.
+
+        start and end are unix timestamps, start is inclusive and end is not.
+        """
+        channel_hash = name_hash(channel) if channel is not None else None
+        user_hash = name_hash(user) if user is not None else None
+
+        paths = self.segments()
+        for number, path in enumerate(paths):
+            if number == len(paths) - 1 and _being_created(path):
+                return
+
+            segment = _Segment(path)
+            try:
+                for timestamp, offset in segment.find(channel_hash, user_hash, start, end):
+                    line = segment.line(offset)
+                    # different names can have the same hash, so check the line it self
+                    if _names_match(line, channel, user):
+                        yield timestamp, line
+            finally:
+                segment.close()
+
+    def lines(self, **filters: Any) -> Iterator[str]:
+        """
+        Like records, but only the raw lines.
+        """
+        for _, line in self.records(**filters):
+            yield line
+
+    def messages(self, core: "TwitchCore", **filters: Any) -> Iterator["Message"]:
+        """
+        Replay the records through the parser of a bot, like they were just read from twitch.
+        """
+        for line in self.lines(**filters):
+            message = core.parse_message(line)
+            if message is not None:
+                yield message
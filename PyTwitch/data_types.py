@@ -1,15 +1,29 @@
-from typing import Callable, List, Dict
-from . import twitch_bot
+import time
+from typing import Any, Callable, List, Dict, Optional, Tuple, TYPE_CHECKING
+from types import ModuleType
 
-# used for type hinting
-from .twitch_api import UserInfo, StreamInfo
+from .metrics import Counter, Gauge, Histogram
+from .tracing import TRACER
+
+# only used for type hinting, importing these at runtime would pull in the api client
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future, ProcessPoolExecutor  # noqa
+    from . import twitch_bot  # noqa
+    from .twitch_api import UserInfo, StreamInfo  # noqa
+    from .analytics import ChannelAnalytics  # noqa
+    from .scheduler import Timer  # noqa
+
+
+COMMAND_SECONDS = Histogram("pytwitch_command_seconds", "Time spent running a command.", ["command"])
+COMMAND_ERRORS = Counter("pytwitch_command_errors_total", "Commands that raised a exception.", ["command"])
+COMMANDS_PENDING = Gauge("pytwitch_process_commands_pending", "Commands waiting on a process pool.", ["command"])
 
 
 class ChannelInfo:
     """
     Contains info about a channel.
     """
-    def __init__(self, data: UserInfo):
+    def __init__(self, data: "UserInfo"):
         self.rank = data["broadcaster_type"]
         self.description = data["description"]
 
@@ -76,6 +90,49 @@ class Channel:
         data = self._bot.api.stream_info(self.name)
         return Stream(data, self._bot)
 
+    @property
+    def analytics(self) -> "ChannelAnalytics":
+        """
+        The chat statistics of this channel, see TwitchBot.enable_analytics.
+        """
+        if self._bot.analytics is None:
+            raise ValueError("Analytics are not enabled, call bot.enable_analytics() first")
+        return self._bot.analytics.channel(self.name)
+
+    @property
+    def messages_per_minute(self) -> int:
+        """
+        How many messages were sent in the last minute.
+        """
+        return self.analytics.messages_per_minute()
+
+    @property
+    def unique_chatters(self) -> int:
+        """
+        About how many different users chatted in the analytics window.
+        """
+        return self.analytics.unique_chatters()
+
+    def top_emotes(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        The most used emotes and about how many times they were used.
+        """
+        return self.analytics.top_emotes(n)
+
+    def top_commands(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        The most used commands and about how many times they were used.
+        """
+        return self.analytics.top_commands(n)
+
+    def schedule(self, interval: float, func: Callable[..., None], **options: Any) -> "Timer":
+        """
+        Call func(channel) every interval seconds, takes the same options as TwitchBot.every.
+
+        channel.schedule(600, lambda channel: channel.send_message("Remember to hydrate!"), jitter=60)
+        """
+        return self._bot.every(interval, func, self, **options)
+
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Channel):
             raise NotImplementedError()
@@ -95,7 +152,7 @@ class Stream:
     """
     def __init__(
             self,
-            data: StreamInfo,
+            data: "StreamInfo",
             bot  # type: twitch_bot.TwitchBot
             ) -> None:
         self.name = data["user_name"]
@@ -201,14 +258,77 @@ class User:
         return f"User(name={self.name})"
 
 
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def _unescape_tag(value: str) -> str:
+    if "\\" not in value:
+        return value
+
+    result: List[str] = []
+    characters = iter(value)
+    for character in characters:
+        if character == "\\":
+            character = next(characters, "")
+            character = _TAG_ESCAPES.get(character, character)
+        result.append(character)
+    return "".join(result)
+
+
 class Message:
     """
     A twith message.
     """
-    def __init__(self, user: User, channel: Channel, message: str):
+    def __init__(self, user: User, channel: Channel, message: str, raw_tags: str = ""):
         self.user = user
         self.channel = channel
         self.content = message
+        self.raw_tags = raw_tags
+        self._tags: Optional[Dict[str, str]] = None
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        """
+        The IRCv3 tags twitch sent with the message, like badges, color and emotes.
+
+        see: https://dev.twitch.tv/docs/irc/tags#privmsg-twitch-tags
+        """
+        if self._tags is None:
+            self._tags = {}
+            if self.raw_tags:
+                for tag in self.raw_tags.split(";"):
+                    key, _, value = tag.partition("=")
+                    self._tags[key] = _unescape_tag(value)
+        return self._tags
+
+    @property
+    def emotes(self) -> List[str]:
+        """
+        The name of every emote used in the message, once for each time it is used.
+        """
+        emotes_tag = self.tags.get("emotes")
+        if not emotes_tag:
+            return []
+
+        # the positions of /me messages are in the text inside the ACTION wrapper
+        text = self.content
+        if text.startswith("\x01ACTION ") and text.endswith("\x01"):
+            text = text[len("\x01ACTION "):-1]
+
+        # the tag looks like <emote id>:<start>-<end>,<start>-<end>/<emote id>:<start>-<end>
+        # where the positions are the characters of the message the emote is at.
+        emotes: List[str] = []
+        for emote in emotes_tag.split("/"):
+            _, _, positions = emote.partition(":")
+            for position in positions.split(","):
+                start, _, end = position.partition("-")
+                # skip ranges that are malformed or outside the message
+                if not (start.isdigit() and end.isdigit()):
+                    continue
+                name = text[int(start):int(end) + 1]
+                if name:
+                    emotes.append(name)
+        return emotes
 
     def reply(self, message: str) -> None:
         """
@@ -250,14 +370,29 @@ class Command:
     """
     A command it self
     """
-    def __init__(self, func: Callable[[Context], None]):
+    def __init__(self, func: Callable[[Context], None], name: Optional[str] = None):
         self.func = func
+        self.name = name if name is not None else func.__name__
+
+        self._seconds = COMMAND_SECONDS.labels(self.name)
+        self._errors = COMMAND_ERRORS.labels(self.name)
+        self._span_name = f"command {self.name}"
 
     def call(self, ctx: Context, arguments: List[str]) -> None:
         """
         Runs the command.
         """
-        self.func(ctx, *arguments)
+        start = time.perf_counter()
+        try:
+            self.func(ctx, *arguments)
+        except Exception:
+            self._errors.inc()
+            raise
+        finally:
+            end = time.perf_counter()
+            self._seconds.observe(end - start)
+            if TRACER.enabled:
+                TRACER.record(self._span_name, start, end)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Command):
@@ -267,3 +402,106 @@ class Command:
 
     def __repr__(self) -> str:
         return f"Command(func={self.func})"
+
+
+class ContextSnapshot:
+    """
+    A picklable copy of a context, passed to commands running in a process pool.
+
+    It only holds the names of the channel and user, the api can not be used from here.
+    Replies are collected and sent by the bot once the command finishes.
+    """
+    def __init__(self, channel_name: str, user_name: str, content: str):
+        self.channel_name = channel_name
+        self.user_name = user_name
+        self.content = content
+        self.replies: List[str] = []
+
+    @classmethod
+    def from_context(cls, ctx: Context) -> "ContextSnapshot":
+        return cls(ctx.channel.name, ctx.user.name, ctx.message.content)
+
+    def reply(self, message: str) -> None:
+        """
+        Queue a message to be sent in the channel the command was activated in.
+        """
+        self.replies.append(str(message))
+
+    def __repr__(self) -> str:
+        return f"ContextSnapshot(channel={self.channel_name}, user={self.user_name})"
+
+
+def _run_snapshot(func: Callable[..., None], snapshot: ContextSnapshot, arguments: List[str]) -> List[str]:
+    """
+    Runs a command inside a worker process, returning the replies it made.
+    """
+    func(snapshot, *arguments)
+    return snapshot.replies
+
+
+class ProcessCommand(Command):
+    """
+    A command that runs in a process pool instead of the bots main loop.
+
+    The function must be defined at the top level of a module so it can be pickled.
+    """
+    def __init__(self, func: Callable[[ContextSnapshot], None], pool: "Executor", name: Optional[str] = None):
+        super().__init__(func, name)  # type: ignore
+        self.pool = pool
+        self._pending = COMMANDS_PENDING.labels(self.name)
+
+    def call(self, ctx: Context, arguments: List[str]) -> None:
+        """
+        Submits the command to the pool, the replies are sent once it is done.
+        """
+        start = time.perf_counter()
+        snapshot = ContextSnapshot.from_context(ctx)
+        future = self.pool.submit(_run_snapshot, self.func, snapshot, arguments)
+        self._pending.inc()
+        # the replies are sent from another thread, so carry the trace over
+        trace_id = TRACER.current_trace
+        future.add_done_callback(lambda done: self._send_replies(ctx, done, start, trace_id))
+
+    def _send_replies(self, ctx: Context, future: "Future[List[str]]", start: float, trace_id: Optional[int]) -> None:
+        self._pending.dec()
+        end = time.perf_counter()
+        self._seconds.observe(end - start)
+        if trace_id is not None:
+            TRACER.record(self._span_name, start, end, trace_id)
+
+        try:
+            replies = future.result()
+        except Exception as e:
+            self._errors.inc()
+            ctx.bot.event_error(ctx.message, e)
+            return
+
+        # the sends are part of the trace of the message that ran the command
+        TRACER.continue_trace(trace_id)
+        try:
+            for reply in replies:
+                ctx.reply(reply)
+        finally:
+            TRACER.end_trace()
+
+    def __repr__(self) -> str:
+        return f"ProcessCommand(func={self.func})"
+
+
+class Cog:
+    """
+    A loaded cog, and everything its setup function registered.
+    """
+    def __init__(self, name: str, module: ModuleType):
+        self.name = name
+        self.module = module
+        self.commands: Dict[str, Command] = {}
+        self.events: Dict[str, Callable[..., None]] = {}
+        self.process_pools: Dict[str, "ProcessPoolExecutor"] = {}
+        self.timers: List["Timer"] = []
+
+        # the event handlers this cog replaced, restored when it is unloaded.
+        self.replaced_events: Dict[str, Optional[Callable[..., None]]] = {}
+
+    def __repr__(self) -> str:
+        return f"Cog(name={self.name})"
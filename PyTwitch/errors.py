@@ -34,3 +34,9 @@ class CommandNotFoundError(KeyError):
     """
     The command was not found.
     """
+
+
+class CogNotLoadedError(KeyError):
+    """
+    The cog is not loaded.
+    """
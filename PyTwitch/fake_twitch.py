@@ -0,0 +1,423 @@
+"""
+Local stand ins for the twitch irc server and the helix api, for load testing a bot.
+
+FakeIrcServer replays chat into the channels a bot has joined at a fixed rate,
+enforces the chat and join rate limits and sends PING and RECONNECT like twitch does.
+FakeHelixServer answers the api calls TwitchApi makes, with optional latency and 429 responses.
+
+Both only use the standard library, and listen on a free local port unless told otherwise:
+
+irc = FakeIrcServer(synthetic_chat(channels), rate=1000).start()
+bot.connect("bot", "oauth:token", host=irc.host, port=irc.port)
+irc.start_replay()
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import os
+import random
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .utils import CHAT_LIMIT, JOIN_LIMIT, RateLimit, RateLimiter  # noqa: F401
+
+SAMPLE_WORDS = ["hello", "pog", "lol", "what", "is", "this", "game", "gg", "nice", "play", "chat", "hype"]
+SAMPLE_EMOTES = {"Kappa": "25", "PogChamp": "88", "LUL": "425618", "Kreygasm": "41"}
+
+
+def format_privmsg(channel: str, user: str, text: str, tags: Optional[Dict[str, str]] = None) -> str:
+    """
+    A chat message as twitch would send it.
+    """
+    line = f":{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #{channel} :{text}"
+    if tags:
+        line = "@" + ";".join(f"{key}={value}" for key, value in tags.items()) + " " + line
+    return line
+
+
+def emote_tag(text: str) -> str:
+    """
+    The emotes tag twitch would add to a message, for the emotes in SAMPLE_EMOTES.
+    """
+    positions: Dict[str, List[str]] = {}
+    index = 0
+    for word in text.split(" "):
+        emote_id = SAMPLE_EMOTES.get(word)
+        if emote_id is not None:
+            positions.setdefault(emote_id, []).append(f"{index}-{index + len(word) - 1}")
+        index += len(word) + 1
+
+    return "/".join(f"{emote_id}:{','.join(ranges)}" for emote_id, ranges in positions.items())
+
+
+def synthetic_chat(channels: List[str], users: int = 500, seed: int = 0) -> Iterator[str]:
+    """
+    A never ending stream of random chat messages spread over channels.
+    """
+    rng = random.Random(seed)
+    vocabulary = SAMPLE_WORDS + list(SAMPLE_EMOTES)
+    while True:
+        channel = rng.choice(channels)
+        user = f"user{rng.randrange(users)}"
+        text = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 12)))
+        yield format_privmsg(channel, user, text, {"emotes": emote_tag(text)})
+
+
+def recorded_chat(path: str, loop: bool = True) -> Iterator[str]:
+    """
+    Replay raw irc lines from a file with one per line, or a chat log directory.
+    """
+    while True:
+        if os.path.isdir(path):
+            from .chat_log import ChatLogReader
+            yield from ChatLogReader(path).lines()
+        else:
+            with open(path, encoding="utf8") as f:
+                for line in f:
+                    line = line.rstrip("\r\n")
+                    if line:
+                        yield line
+        if not loop:
+            return
+
+
+def _line_channel(line: str) -> Optional[str]:
+    """
+    The channel a irc line was sent in, if any.
+    """
+    if line.startswith("@"):
+        line = line.split(" ", 1)[1]
+    parts = line.split(" ", 3)
+    if len(parts) >= 3 and parts[2].startswith("#"):
+        return parts[2][1:]
+    return None
+
+
+def _strip_tags(line: str) -> str:
+    if line.startswith("@"):
+        return line.split(" ", 1)[1]
+    return line
+
+
+class FakeIrcClient:
+    """
+    A connection to the fake irc server.
+    """
+    def __init__(self, server: "FakeIrcServer", sock: socket.socket) -> None:
+        self.server = server
+        self.sock = sock
+        self.nick: Optional[str] = None
+        self.channels: Set[str] = set()
+        self.tags = False
+        self.last_pong = time.monotonic()
+
+        self._send_lock = threading.Lock()
+        self._chat_limit = RateLimiter(server.chat_limit)
+        self._join_limit = RateLimiter(server.join_limit)
+
+    def send_lines(self, lines: List[str]) -> None:
+        data = "".join(line + "\r\n" for line in lines).encode()
+        try:
+            with self._send_lock:
+                self.sock.sendall(data)
+        except OSError:
+            self.server._remove_client(self)
+
+    def handle_line(self, line: str) -> None:
+        command, _, params = line.partition(" ")
+        handler = getattr(self, f"_on_{command.lower()}", None)
+        if handler is not None:
+            handler(params, time.monotonic())
+
+    def _on_nick(self, params: str, now: float) -> None:
+        self.nick = params
+        self.send_lines([f":tmi.twitch.tv 001 {params} :Welcome, GLHF!"])
+
+    def _on_cap(self, params: str, now: float) -> None:
+        if "twitch.tv/tags" in params:
+            self.tags = True
+        self.send_lines([f":tmi.twitch.tv CAP * ACK :{params.split(':', 1)[-1]}"])
+
+    def _on_join(self, params: str, now: float) -> None:
+        for channel in params.split(","):
+            if not self._join_limit.allow(now):
+                self.server.limit_violations["join"] += 1
+                continue
+            channel = channel.lstrip("#")
+            self.channels.add(channel)
+            self.send_lines([f":{self.nick}!{self.nick}@{self.nick}.tmi.twitch.tv JOIN #{channel}"])
+
+    def _on_part(self, params: str, now: float) -> None:
+        self.channels.discard(params.lstrip("#"))
+
+    def _on_privmsg(self, params: str, now: float) -> None:
+        if not self._chat_limit.allow(now):
+            # twitch drops messages over the limit without telling the sender
+            self.server.limit_violations["chat"] += 1
+            return
+        channel, _, text = params.partition(" :")
+        self.server._record_reply(channel.lstrip("#"), text)
+
+    def _on_pong(self, params: str, now: float) -> None:
+        self.last_pong = now
+        self.server.pongs += 1
+
+
+class _IrcHandler(socketserver.BaseRequestHandler):
+    server: "_ThreadingTCPServer"
+
+    def handle(self) -> None:
+        fake = self.server.fake
+        client = FakeIrcClient(fake, self.request)
+        fake._add_client(client)
+
+        buffer = b""
+        try:
+            while True:
+                data = self.request.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b"\r\n")
+                for line in lines:
+                    client.handle_line(line.decode("utf8", "replace"))
+        except OSError:
+            pass
+        finally:
+            fake._remove_client(client)
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    fake: "FakeIrcServer"
+
+
+class FakeIrcServer:
+    """
+    A irc server behaving like twitch chat.
+
+    lines is the chat to replay, raw irc lines like the ones from synthetic_chat or recorded_chat.
+    They are sent at rate lines per second, each to the clients that joined its channel.
+    Tags are removed for clients that did not request the twitch.tv/tags capability.
+
+    chat_limit and join_limit can be set to None to turn them off,
+    messages over the limits are dropped and counted in limit_violations.
+    Clients are sent a PING every ping_interval seconds, and if reconnect_after is set,
+    a RECONNECT after that many seconds before being disconnected.
+    """
+    def __init__(self,
+                 lines: Iterable[str],
+                 rate: float = 100.0,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 chat_limit: Optional[RateLimit] = CHAT_LIMIT,
+                 join_limit: Optional[RateLimit] = JOIN_LIMIT,
+                 ping_interval: Optional[float] = 60.0,
+                 reconnect_after: Optional[float] = None
+                 ) -> None:
+        self.lines = iter(lines)
+        self.rate = rate
+        self.chat_limit = chat_limit
+        self.join_limit = join_limit
+        self.ping_interval = ping_interval
+        self.reconnect_after = reconnect_after
+
+        self.clients: List[FakeIrcClient] = []
+        self.lines_sent = 0
+        self.pongs = 0
+        self.limit_violations = {"chat": 0, "join": 0}
+        # (time.perf_counter(), channel, text) for every chat message clients sent
+        self.replies: List[Tuple[float, str, str]] = []
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._tcp = _ThreadingTCPServer((host, port), _IrcHandler)
+        self._tcp.fake = self
+        self.host = host
+        self.port: int = self._tcp.server_address[1]
+
+    def start(self) -> "FakeIrcServer":
+        """
+        Start accepting connections in a background thread.
+
+        Chat is not replayed until start_replay is called, so the bot has time to join its channels.
+        """
+        threading.Thread(target=self._tcp.serve_forever, name="fake-irc", daemon=True).start()
+        threading.Thread(target=self._keepalive, name="fake-irc-ping", daemon=True).start()
+        return self
+
+    def start_replay(self) -> None:
+        threading.Thread(target=self._replay, name="fake-irc-replay", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._tcp.shutdown()
+        self._tcp.server_close()
+        for client in list(self.clients):
+            client.sock.close()
+
+    def _add_client(self, client: FakeIrcClient) -> None:
+        with self._lock:
+            self.clients.append(client)
+
+    def _remove_client(self, client: FakeIrcClient) -> None:
+        with self._lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def _record_reply(self, channel: str, text: str) -> None:
+        self.replies.append((time.perf_counter(), channel, text))
+
+    def _replay(self) -> None:
+        """
+        Send lines at the configured rate, in batches so high rates do not need a sleep per line.
+        """
+        start = time.perf_counter()
+        while not self._stopped.is_set():
+            due = int((time.perf_counter() - start) * self.rate) - self.lines_sent
+            if due <= 0:
+                time.sleep(0.001)
+                continue
+
+            batch = list(itertools.islice(self.lines, due))
+            if not batch:
+                return
+            self.lines_sent += len(batch)
+
+            with self._lock:
+                clients = list(self.clients)
+            for client in clients:
+                lines = [line if client.tags else _strip_tags(line)
+                         for line in batch if _line_channel(line) in client.channels]
+                if lines:
+                    client.send_lines(lines)
+
+    def _keepalive(self) -> None:
+        started = time.monotonic()
+        last_ping = started
+        while not self._stopped.wait(0.1):
+            now = time.monotonic()
+            with self._lock:
+                clients = list(self.clients)
+
+            if self.ping_interval is not None and now - last_ping >= self.ping_interval:
+                last_ping = now
+                for client in clients:
+                    # twitch disconnects clients that did not answer the last PING
+                    if now - client.last_pong > 2 * self.ping_interval:
+                        client.sock.close()
+                        continue
+                    client.send_lines(["PING :tmi.twitch.tv"])
+
+            if self.reconnect_after is not None and now - started >= self.reconnect_after:
+                started = now
+                for client in clients:
+                    client.send_lines([":tmi.twitch.tv RECONNECT"])
+                    client.sock.close()
+
+
+class FakeHelixServer:
+    """
+    A http server answering the helix and tmi calls TwitchApi makes.
+
+    Every request waits latency seconds, and a share of them given by ratelimit_rate get a 429.
+    Pass helix_url and tmi_url to the bot to use it.
+    """
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: float = 0.0,
+                 ratelimit_rate: float = 0.0,
+                 seed: int = 0
+                 ) -> None:
+        self.latency = latency
+        self.ratelimit_rate = ratelimit_rate
+        self.requests: Dict[str, int] = {}
+        self.ratelimited = 0
+
+        self._random = random.Random(seed)
+        self._http = ThreadingHTTPServer((host, port), self._make_handler())
+        self._http.daemon_threads = True
+        self.host = host
+        self.port: int = self._http.server_address[1]
+
+    @property
+    def helix_url(self) -> str:
+        return f"http://{self.host}:{self.port}/helix"
+
+    @property
+    def tmi_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeHelixServer":
+        threading.Thread(target=self._http.serve_forever, name="fake-helix", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._http.shutdown()
+        self._http.server_close()
+
+    def respond(self, path: str, query: Dict[str, str]) -> Tuple[int, Any]:
+        """
+        The status code and json body for a request.
+        """
+        if path.startswith("/group/user/") and path.endswith("/chatters"):
+            channel = path.split("/")[3]
+            return 200, {"chatters": {"broadcaster": [channel], "moderators": [], "viewers": ["user1", "user2"]}}
+
+        if path == "/helix/users":
+            login = query.get("login", "user")
+            return 200, {"data": [{
+                "id": str(abs(hash(login)) % 10 ** 8), "login": login, "display_name": login, "type": "",
+                "broadcaster_type": "", "description": "", "profile_image_url": "", "offline_image_url": "",
+                "view_count": "0", "email": ""
+                }], "pagination": {}}
+
+        if path == "/helix/users/follows":
+            return 200, {"data": [], "total": 0, "pagination": {}}
+
+        if path == "/helix/streams":
+            login = query.get("user_login", "user")
+            return 200, {"data": [{
+                "id": "1", "user_id": "1", "user_name": login, "game_id": "509658", "type": "live",
+                "title": "testing", "viewer_count": 10, "started_at": "", "language": "en", "thumbnail_url": ""
+                }], "pagination": {}}
+
+        if path == "/helix/games":
+            return 200, {"data": [{"id": query.get("id", "0"), "name": "Just Chatting", "box_art_url": ""}], "pagination": {}}
+
+        return 404, {"error": "Not Found", "status": 404, "message": ""}
+
+    def _make_handler(self) -> type:
+        fake = self
+
+        class HelixHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                fake.requests[url.path] = fake.requests.get(url.path, 0) + 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if fake.ratelimit_rate and fake._random.random() < fake.ratelimit_rate:
+                    fake.ratelimited += 1
+                    status, body = 429, {"error": "Too Many Requests", "status": 429, "message": ""}
+                else:
+                    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    status, body = fake.respond(url.path, query)
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        return HelixHandler
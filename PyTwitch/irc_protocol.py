@@ -1,5 +1,29 @@
+from collections import deque
+import time
 from .socket_wrapper import SocketWrapper
-from typing import List
+from .metrics import Counter
+from typing import Deque, List, Optional, Tuple
+
+LINES_READ = Counter("pytwitch_irc_lines_read_total", "Lines framed from the data read from the irc server.")
+PINGS = Counter("pytwitch_irc_pings_total", "PING messages answered.")
+
+
+def split_command(line: str) -> Tuple[str, str]:
+    """
+    The command of a irc line, like PRIVMSG or PING, and the parameters after it.
+
+    The tags and the prefix before the command are skipped.
+    """
+    start = 0
+    if line.startswith("@"):
+        start = line.find(" ") + 1
+    if line.startswith(":", start):
+        start = line.find(" ", start) + 1
+
+    end = line.find(" ", start)
+    if end == -1:
+        return line[start:], ""
+    return line[start:end], line[end + 1:]
 
 
 class IrcProtocol:
@@ -8,7 +32,11 @@ class IrcProtocol:
     """
     def __init__(self) -> None:
         self._sock = SocketWrapper()
-        self._data: List[str] = []
+        self._data: Deque[str] = deque()
+        # the start of a line whose end has not been read yet
+        self._partial = ""
+        # set when the server sent RECONNECT, raised once the lines read before it are handed out
+        self._reconnect_requested = False
 
     def connect(self, server: str, port: int = 667) -> None:
         """
@@ -18,6 +46,12 @@ class IrcProtocol:
         """
         self._sock.connect(server, port)
 
+    def close(self) -> None:
+        """
+        Disconnect from the server.
+        """
+        self._sock.close()
+
     def login(self, username: str, password: str) -> None:
         """
         Login to the irc server
@@ -25,6 +59,12 @@ class IrcProtocol:
         self._sock.send(f"PASS {password}")
         self._sock.send(f"NICK {username}")
 
+    def request_capabilities(self, capabilities: List[str]) -> None:
+        """
+        Ask the server to turn on IRCv3 capabilities, like twitch.tv/tags.
+        """
+        self._sock.send(f"CAP REQ :{' '.join(capabilities)}")
+
     def join_channel(self, channel: str) -> None:
         """
         Join the specified channel.
@@ -37,18 +77,36 @@ class IrcProtocol:
         """
         self._sock.send(f"PRIVMSG #{channel} :{message}")
 
-    def read(self) -> str:
+    def read(self, timeout: Optional[float] = None) -> Optional[str]:
         """
         Reads one line of info from the connected server.
+
+        If timeout is given, returns None if no full line arrived in that many seconds.
+        raises ConnectionError if the connection was closed, or the server asked us to reconnect.
         """
-        if not self._data:
-            new_data = self._sock.read().split("\n")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._data:
+            if self._reconnect_requested:
+                raise ConnectionError("The server asked us to reconnect")
+            if deadline is not None and not self._sock.readable(max(0.0, deadline - time.monotonic())):
+                return None
+
+            *new_data, self._partial = (self._partial + self._sock.read()).split("\n")
 
-            # respond to PING messages
             for message in new_data:
-                if "PING" in message:
-                    self._sock.send("PONG")
+                if not message:
+                    continue
+
+                # only the command is checked, chat messages can contain these words too
+                command, parameters = split_command(message)
+                if command == "PING":
+                    self._sock.send(f"PONG {parameters}" if parameters else "PONG")
+                    PINGS.inc()
+                elif command == "RECONNECT":
+                    self._reconnect_requested = True
+                    continue
 
-            self._data.extend(new_data)
+                self._data.append(message)
+                LINES_READ.inc()
 
-        return self._data.pop(0)
+        return self._data.popleft()
@@ -0,0 +1,235 @@
+"""
+Counters, gauges and histograms describing what the bot is doing.
+
+Recording a value is a attribute update, so it is cheap enough to do for every message.
+The values are not locked, a update racing with another thread can be lost,
+which is fine for metrics but means they should not be used for anything else.
+
+The metrics can be read in the prometheus text format, either from REGISTRY.exposition()
+or over http using TwitchBot.serve_metrics.
+"""
+import abc
+from bisect import bisect_left
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple, TypeVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import HTTPServer  # noqa
+
+# in seconds, from half a millisecond to 10 seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+MetricType = TypeVar("MetricType", bound="Metric")
+
+
+class Registry:
+    """
+    A collection of metrics that can be exposed together.
+    """
+    def __init__(self) -> None:
+        self._metrics: Dict[str, "Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["Metric"]:
+        return self._metrics.get(name)
+
+    def exposition(self) -> str:
+        """
+        All the metrics in the prometheus text format.
+        """
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> "HTTPServer":
+        """
+        Serve the metrics over http from a background thread.
+        """
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                # scrapes would spam stderr otherwise
+                pass
+
+        server = HTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels.items():
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(abc.ABC):
+    """
+    The base of all metrics.
+
+    A metric with label names does not hold a value it self,
+    use labels to get the child holding the value for some label values.
+    """
+    type_name = "untyped"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str = "",
+                 label_names: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY
+                 ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], Metric] = {}
+
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self: MetricType, *values: str) -> MetricType:
+        """
+        The child of this metric with the given label values.
+
+        Look it up once and keep it around when it is used on a hot path.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, but got {values}")
+            child = self._new_child()
+            self._children[values] = child
+        return child  # type: ignore
+
+    def _new_child(self: MetricType) -> MetricType:
+        return type(self)(self.name, registry=None)
+
+    @abc.abstractmethod
+    def _samples(self) -> List[Sample]:
+        """
+        The suffix, extra labels and value of each sample, implemented by every kind of metric.
+        """
+
+    def expose(self) -> List[str]:
+        lines = [
+                f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.type_name}"
+                ]
+
+        if self.label_names:
+            children = [(dict(zip(self.label_names, values)), child) for values, child in list(self._children.items())]
+        else:
+            children = [({}, self)]
+
+        for labels, child in children:
+            for suffix, extra_labels, value in child._samples():
+                all_labels = dict(labels, **extra_labels)
+                lines.append(f"{self.name}{suffix}{_format_labels(all_labels)} {_format_value(value)}")
+
+        return lines
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+    """
+    type_name = "counter"
+    value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _samples(self) -> List[Sample]:
+        return [("", {}, self.value)]
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+    """
+    type_name = "gauge"
+    value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def _samples(self) -> List[Sample]:
+        return [("", {}, self.value)]
+
+
+class Histogram(Metric):
+    """
+    Counts how many observed values fall in each of a fixed set of buckets.
+
+    Mostly used for how long things take, in seconds.
+    """
+    type_name = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str = "",
+                 label_names: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS
+                 ) -> None:
+        super().__init__(name, documentation, label_names, registry)
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _new_child(self) -> "Histogram":  # type: ignore
+        return Histogram(self.name, registry=None, buckets=self.buckets)
+
+    def _samples(self) -> List[Sample]:
+        samples: List[Sample] = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            samples.append(("_bucket", {"le": _format_value(bound)}, total))
+
+        samples.append(("_sum", {}, self.sum))
+        samples.append(("_count", {}, total))
+        return samples
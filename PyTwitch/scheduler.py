@@ -0,0 +1,297 @@
+"""
+Runs functions at a set time or every few seconds, on the thread running the bot, so
+recurring announcements and polls need no thread of their own.
+
+Timers are kept in a hierarchical timer wheel, LEVELS levels of 64 slots each. The first level
+holds the timers due in the next 64 ticks, one slot per tick, the second the timers due in the
+next 64 * 64 ticks, 64 ticks per slot, and so on. Every tick only looks at the one slot of the
+first level that is due, and when a slot of a higher level comes up its timers are moved down a
+level. So adding and cancelling a timer is O(1), and so is a tick, no matter how many timers wait.
+
+timer = bot.every(600, announce, jitter=30)
+timer.cancel()
+"""
+import math
+import random
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from .metrics import Counter, Histogram
+
+TIMERS_RUN = Counter("pytwitch_timers_run_total", "Scheduled functions run.")
+TIMERS_SKIPPED = Counter("pytwitch_timers_skipped_total", "Scheduled runs dropped by the skip misfire policy.")
+TIMER_ERRORS = Counter("pytwitch_timer_errors_total", "Exceptions raised by scheduled functions.")
+TIMER_LATENESS = Histogram("pytwitch_timer_lateness_seconds", "How long after it was due a scheduled function ran.",
+                           buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0))
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4
+
+# coalesce: a late timer runs once, however many runs it missed
+# catch_up: a late timer runs once for every run it missed
+# skip: runs more than grace seconds late are dropped
+MISFIRE_POLICIES = ("coalesce", "catch_up", "skip")
+
+# timers can be added from other threads while the bot waits for chat, so it checks at least this often
+MAX_WAIT = 1.0
+
+
+class Timer:
+    """
+    A scheduled function, cancel it to stop it from running.
+    """
+    def __init__(self,
+                 func: Callable[..., None],
+                 args: Tuple[Any, ...],
+                 due: float,
+                 interval: Optional[float] = None,
+                 jitter: float = 0.0,
+                 misfire: str = "coalesce",
+                 grace: float = 1.0
+                 ) -> None:
+        if interval is not None and interval <= 0:
+            raise ValueError("interval must be positive")
+        if jitter < 0:
+            raise ValueError("jitter can not be negative")
+        if misfire not in MISFIRE_POLICIES:
+            raise ValueError(f"misfire must be one of {', '.join(MISFIRE_POLICIES)}")
+
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.jitter = jitter
+        self.misfire = misfire
+        self.grace = grace
+        self.cancelled = False
+        self.runs = 0
+
+        # when the next run is due before jitter, runs are counted from this so the jitter does not add up
+        self.due = due
+        self.next_run = due + random.uniform(0, jitter) if jitter else due
+        self._tick = 0
+
+    def cancel(self) -> None:
+        """
+        Stop the timer, it is dropped from the wheel once its slot comes up.
+        """
+        self.cancelled = True
+
+    def _reschedule(self, now: float) -> bool:
+        """
+        Move on to the next run, return False if there is none.
+        """
+        if self.interval is None or self.cancelled:
+            return False
+
+        self.due += self.interval
+        if self.misfire != "catch_up" and self.due < now:
+            # go to the first run that is not missed yet
+            self.due += math.ceil((now - self.due) / self.interval) * self.interval
+        self.next_run = self.due + random.uniform(0, self.jitter) if self.jitter else self.due
+        return True
+
+    def __repr__(self) -> str:
+        name = getattr(self.func, "__name__", repr(self.func))
+        return f"Timer(func={name}, interval={self.interval}, cancelled={self.cancelled})"
+
+
+class Scheduler:
+    """
+    A timer wheel ticking every resolution seconds, timers run at most one tick late.
+
+    Call run_pending to run the timers that are due, timeout says how long it can wait until then.
+    """
+    def __init__(self, resolution: float = 0.05, clock: Callable[[], float] = time.monotonic) -> None:
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+
+        self.resolution = resolution
+        self.clock = clock
+        self.on_error: Callable[[Timer, Exception], None] = lambda timer, e: None
+
+        self._origin = clock()
+        self._tick = 0
+        self._wheel: List[List[List[Timer]]] = [[[] for _ in range(SLOTS)] for _ in range(LEVELS)]
+        # timers due further away than the wheel reaches
+        self._overflow: List[Timer] = []
+        # timers due at or before the current tick
+        self._due: List[Timer] = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """
+        How many timers are waiting, cancelled timers count until they are dropped.
+        """
+        return self._count
+
+    def every(self,
+              interval: float,
+              func: Callable[..., None],
+              *args: Any,
+              delay: Optional[float] = None,
+              jitter: float = 0.0,
+              misfire: str = "coalesce",
+              grace: float = 1.0
+              ) -> Timer:
+        """
+        Call func(*args) every interval seconds, the first time after delay seconds, defaulting to interval.
+
+        Each run happens up to jitter seconds later than due, at random, so timers started together spread out.
+        """
+        start = interval if delay is None else delay
+        return self.add(Timer(func, args, self.clock() + start, interval, jitter, misfire, grace))
+
+    def after(self, delay: float, func: Callable[..., None], *args: Any, jitter: float = 0.0,
+              misfire: str = "coalesce", grace: float = 1.0) -> Timer:
+        """
+        Call func(*args) once, after delay seconds.
+        """
+        return self.add(Timer(func, args, self.clock() + delay, None, jitter, misfire, grace))
+
+    def at(self, when: float, func: Callable[..., None], *args: Any, jitter: float = 0.0,
+           misfire: str = "coalesce", grace: float = 1.0) -> Timer:
+        """
+        Call func(*args) once, at the unix timestamp when.
+        """
+        return self.after(when - time.time(), func, *args, jitter=jitter, misfire=misfire, grace=grace)
+
+    def add(self, timer: Timer) -> Timer:
+        with self._lock:
+            self._count += 1
+            self._place(timer, math.ceil((timer.next_run - self._origin) / self.resolution))
+        return timer
+
+    def _place(self, timer: Timer, tick: int) -> None:
+        timer._tick = tick
+        if tick <= self._tick:
+            self._due.append(timer)
+            return
+
+        # the level is decided by the highest bit the tick differs from the current tick in,
+        # so a timer is always in a slot of its level that has not come up yet
+        level = ((tick ^ self._tick).bit_length() - 1) // SLOT_BITS
+        if level >= LEVELS:
+            self._overflow.append(timer)
+        else:
+            self._wheel[level][(tick >> (level * SLOT_BITS)) & SLOT_MASK].append(timer)
+
+    def _cascade(self, timers: List[Timer]) -> None:
+        for timer in timers:
+            if timer.cancelled:
+                self._count -= 1
+            else:
+                self._place(timer, timer._tick)
+
+    def _advance(self) -> None:
+        """
+        Move one tick forward, the timers due then are put in _due.
+        """
+        tick = self._tick = self._tick + 1
+        if tick & SLOT_MASK == 0:
+            if tick & ((1 << (LEVELS * SLOT_BITS)) - 1) == 0 and self._overflow:
+                overflow, self._overflow = self._overflow, []
+                self._cascade(overflow)
+
+            # higher levels first, their timers can move into the slot of a lower level that is up now
+            for level in range(LEVELS - 1, 0, -1):
+                if tick & ((1 << (level * SLOT_BITS)) - 1) == 0:
+                    slot = (tick >> (level * SLOT_BITS)) & SLOT_MASK
+                    timers = self._wheel[level][slot]
+                    if timers:
+                        self._wheel[level][slot] = []
+                        self._cascade(timers)
+
+        timers = self._wheel[0][tick & SLOT_MASK]
+        if timers:
+            self._wheel[0][tick & SLOT_MASK] = []
+            self._due.extend(timers)
+
+    def _take_due(self, now: float) -> List[Timer]:
+        target = int((now - self._origin) / self.resolution)
+        with self._lock:
+            while self._tick < target:
+                if self._count == len(self._due):
+                    # nothing left in the wheel, no need to look at every empty tick
+                    self._tick = target
+                    break
+                self._advance()
+
+            due, self._due = self._due, []
+            self._count -= len(due)
+        return due
+
+    def run_pending(self, now: Optional[float] = None) -> int:
+        """
+        Run every timer that is due, return how many ran.
+        """
+        ran = 0
+        while True:
+            current = self.clock() if now is None else now
+            # called for every message, so return early without the lock while no tick has passed
+            if not self._due and int((current - self._origin) / self.resolution) <= self._tick:
+                return ran
+
+            due = self._take_due(current)
+            if not due:
+                return ran
+
+            for timer in due:
+                if not timer.cancelled:
+                    ran += self._run(timer, current)
+                    if timer._reschedule(current):
+                        self.add(timer)
+
+    def _run(self, timer: Timer, now: float) -> int:
+        lateness = max(0.0, now - timer.next_run)
+        if timer.misfire == "skip" and lateness > timer.grace:
+            TIMERS_SKIPPED.inc()
+            return 0
+
+        TIMER_LATENESS.observe(lateness)
+        timer.runs += 1
+        try:
+            timer.func(*timer.args)
+        except Exception as e:
+            TIMER_ERRORS.inc()
+            self.on_error(timer, e)
+        TIMERS_RUN.inc()
+        return 1
+
+    def timeout(self) -> float:
+        """
+        How many seconds until run_pending has something to do, at most MAX_WAIT.
+        """
+        with self._lock:
+            if self._due:
+                return 0.0
+            if not self._count:
+                return MAX_WAIT
+
+            # the next filled slot of the first level, or the next time timers are moved down to it
+            current = self._tick & SLOT_MASK
+            ticks = SLOTS - current
+            for offset in range(1, SLOTS - current):
+                if self._wheel[0][current + offset]:
+                    ticks = offset
+                    break
+            wait = self._origin + (self._tick + ticks) * self.resolution - self.clock()
+
+        return min(MAX_WAIT, max(0.0, wait))
+
+    def clear(self) -> None:
+        """
+        Cancel every timer.
+        """
+        with self._lock:
+            slots = [self._due, self._overflow] + [slot for level in self._wheel for slot in level]
+            for timers in slots:
+                for timer in timers:
+                    timer.cancel()
+            self._wheel = [[[] for _ in range(SLOTS)] for _ in range(LEVELS)]
+            self._overflow = []
+            self._due = []
+            self._count = 0
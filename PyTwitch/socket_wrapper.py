@@ -1,4 +1,12 @@
+import codecs
+import select
 import socket
+import threading
+
+from .metrics import Counter
+
+BYTES_READ = Counter("pytwitch_irc_bytes_read_total", "Bytes read from the irc socket.")
+BYTES_SENT = Counter("pytwitch_irc_bytes_sent_total", "Bytes sent over the irc socket.")
 
 
 class SocketWrapper:
@@ -8,6 +16,10 @@ class SocketWrapper:
 
     def __init__(self) -> None:
         self._sock = socket.socket()
+        # commands running in process pools reply from another thread
+        self._send_lock = threading.Lock()
+        # a multi byte character can be split between two reads
+        self._decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
 
     def connect(self, addr: str, port: int) -> None:
         """
@@ -20,11 +32,32 @@ class SocketWrapper:
         Send data over the socket
         """
         encoded_data: bytes = (data + "\r\n").encode()
-        self._sock.sendall(encoded_data)
+        with self._send_lock:
+            self._sock.sendall(encoded_data)
+        BYTES_SENT.inc(len(encoded_data))
+
+    def close(self) -> None:
+        """
+        Close the connection
+        """
+        self._sock.close()
+
+    def readable(self, timeout: float) -> bool:
+        """
+        Wait up to timeout seconds for data to read.
+        """
+        readable, _, _ = select.select([self._sock], [], [], timeout)
+        return bool(readable)
 
     def read(self) -> str:
         """
         Read data from the socket
+
+        raises ConnectionError if the server closed the connection.
         """
         data = self._sock.recv(2048)
-        return data.decode().replace("\r", "\n")
+        if not data:
+            raise ConnectionError("The server closed the connection")
+
+        BYTES_READ.inc(len(data))
+        return self._decoder.decode(data).replace("\r", "\n")
@@ -0,0 +1,141 @@
+"""
+Per message tracing, to find out where the time went when a reply is slow.
+
+A sampled message gets a trace id when it is read, and the bot records spans for
+reading, parsing, dispatching, commands, api calls and sending while handling it.
+Nothing has to be changed in the handlers themself.
+
+The spans can be exported in the chrome trace event format, which can be opened in
+https://ui.perfetto.dev or chrome://tracing.
+"""
+from collections import deque
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Deque, Dict, IO, List, Optional, Tuple, Union
+
+# name, start, end, trace id, thread id, extra args
+SpanRecord = Tuple[str, float, float, int, int, Optional[Dict[str, Any]]]
+
+
+class Tracer:
+    """
+    Collects the spans of sampled messages.
+
+    Tracing is off until a sample rate above 0 is set, and only costs a attribute check while off.
+    Only the newest max_spans spans are kept.
+    """
+    def __init__(self, sample_rate: float = 0.0, max_spans: int = 100_000) -> None:
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.spans: Deque[SpanRecord] = deque(maxlen=max_spans)
+        self.configure(sample_rate, max_spans)
+
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        # perf_counter has no fixed start, so timestamps are exported relative to this
+        self._epoch = time.perf_counter()
+
+    def configure(self, sample_rate: float, max_spans: Optional[int] = None) -> None:
+        """
+        Change how many messages are traced, 1 traces every message and 0 turns tracing off.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, but got {sample_rate}")
+
+        self.sample_rate = sample_rate
+        self.enabled = sample_rate > 0
+        if max_spans is not None and max_spans != self.spans.maxlen:
+            self.spans = deque(self.spans, maxlen=max_spans)
+
+    @property
+    def current_trace(self) -> Optional[int]:
+        """
+        The trace id of the message being handled by this thread, if it is sampled.
+        """
+        trace_id: Optional[int] = getattr(self._local, "trace_id", None)
+        return trace_id
+
+    def start_trace(self) -> Optional[int]:
+        """
+        Decide if the message this thread is about to handle is traced.
+
+        return the new trace id, or None if it was not sampled.
+        """
+        trace_id: Optional[int] = None
+        if self.enabled and random.random() < self.sample_rate:
+            trace_id = next(self._ids)
+
+        self._local.trace_id = trace_id
+        return trace_id
+
+    def continue_trace(self, trace_id: Optional[int]) -> None:
+        """
+        Make this thread record into a trace started by another thread.
+        """
+        self._local.trace_id = trace_id
+
+    def end_trace(self) -> None:
+        self._local.trace_id = None
+
+    def record(self,
+               name: str,
+               start: float,
+               end: float,
+               trace_id: Optional[int] = None,
+               args: Optional[Dict[str, Any]] = None
+               ) -> None:
+        """
+        Record a span, start and end being values from time.perf_counter.
+
+        If no trace id is given the current trace is used, and nothing is recorded if there is none.
+        """
+        if trace_id is None:
+            trace_id = self.current_trace
+            if trace_id is None:
+                return
+
+        self.spans.append((name, start, end, trace_id, threading.get_ident(), args))
+
+    def chrome_trace(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        The recorded spans as chrome trace events.
+        """
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = []
+        for name, start, end, trace_id, thread_id, extra in list(self.spans):
+            args: Dict[str, Any] = {"trace_id": trace_id}
+            if extra is not None:
+                args.update(extra)
+
+            events.append({
+                "name": name,
+                "cat": "pytwitch",
+                "ph": "X",
+                "ts": (start - self._epoch) * 1_000_000,
+                "dur": (end - start) * 1_000_000,
+                "pid": pid,
+                "tid": thread_id,
+                "args": args
+                })
+
+        return {"traceEvents": events}
+
+    def export(self, file: Union[str, IO[str]]) -> None:
+        """
+        Write the recorded spans to a file or path as chrome trace event json.
+        """
+        if isinstance(file, str):
+            with open(file, "w", encoding="utf8") as f:
+                json.dump(self.chrome_trace(), f)
+        else:
+            json.dump(self.chrome_trace(), file)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+
+TRACER = Tracer()
@@ -1,12 +1,25 @@
+import sys
 from typing import List, Dict, Union, Optional  # , Mapping
-from typing_extensions import TypedDict
+
+if sys.version_info >= (3, 8):
+    from typing import TypedDict
+else:
+    from typing_extensions import TypedDict
 
 from functools import lru_cache
+import time
+from urllib.parse import urlsplit
 import warnings
 
 import requests
 
 from .errors import NoClientId, RatelimitError, ResponseCodeError, StreamerNotLiveError
+from .metrics import Counter, Histogram
+from .tracing import TRACER
+
+API_REQUESTS = Counter("pytwitch_api_requests_total", "Requests made to the twitch api.", ["endpoint", "status"])
+API_SECONDS = Histogram("pytwitch_api_seconds", "Time spent waiting on the twitch api.", ["endpoint"])
+API_RETRIES = Counter("pytwitch_api_retries_total", "Requests retried because of the twitch rate limit.", ["endpoint"])
 
 # types
 UserInfo = TypedDict("UserInfo", {
@@ -51,12 +64,25 @@ ApiRespons = TypedDict("ApiRespons", {
     })
 
 
+HELIX_URL = "https://api.twitch.tv/helix"
+TMI_URL = "http://tmi.twitch.tv"
+
+
 class TwitchApi:
     """
     A wrapper around the twitch api.
+
+    helix_url and tmi_url can be changed to use something other than twitch, like a local test server.
     """
-    def __init__(self, client_id: Optional[str], retry_limit: int = 10):
+    def __init__(self,
+                 client_id: Optional[str],
+                 retry_limit: int = 10,
+                 helix_url: str = HELIX_URL,
+                 tmi_url: str = TMI_URL
+                 ):
         self.client_id = client_id
+        self.helix_url = helix_url.rstrip("/")
+        self.tmi_url = tmi_url.rstrip("/")
 
         if retry_limit <= 0:
             raise ValueError("retry_limit must be positiv.")
@@ -72,18 +98,28 @@ class TwitchApi:
         """
         Calls the given url with the current session.
         """
+        endpoint = urlsplit(url).path
+        seconds = API_SECONDS.labels(endpoint)
+
         for retries_left in range(self.retry_limit, -1, -1):
+            start = time.perf_counter()
             if method == "get":
                 response = self.session.get(url)
             elif method == "post":
                 response = self.session.get(url)
             else:
                 raise ValueError(f"invalid method: {method}")
+            end = time.perf_counter()
+            seconds.observe(end - start)
+            API_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+            if TRACER.enabled:
+                TRACER.record(f"api {endpoint}", start, end, args={"status": response.status_code})
 
             if response.status_code == 429:
                 # Rate limit error
                 if retries_left == 0:
                     raise RatelimitError(f"Ratelimit retried reached ({self.retry_limit})")
+                API_RETRIES.labels(endpoint).inc()
                 warnings.warn("twitch api ratelimit hit, sleeping for 5 seconds. reties left: {}")
                 continue
 
@@ -95,9 +131,16 @@ class TwitchApi:
         """
         The users in chat and their highest role.
         """
-        url = f"http://tmi.twitch.tv/group/user/{channel}/chatters"
+        url = f"{self.tmi_url}/group/user/{channel}/chatters"
         # we dont use the session since this is not a offical twich api and it does not need the client-id
+        start = time.perf_counter()
         response = requests.get(url)
+        # the channel is left out of the endpoint, to not make a new label for every channel
+        end = time.perf_counter()
+        API_SECONDS.labels("/group/user/chatters").observe(end - start)
+        API_REQUESTS.labels("/group/user/chatters", str(response.status_code)).inc()
+        if TRACER.enabled:
+            TRACER.record("api /group/user/chatters", start, end, args={"status": response.status_code})
 
         if response.status_code != 200:
             raise ResponseCodeError(f"Excpected a 200 response, but got {response.status_code}")
@@ -141,7 +184,7 @@ class TwitchApi:
         if self.client_id is None:
             raise NoClientId()
 
-        url = f"https://api.twitch.tv/helix/users?login={username}"
+        url = f"{self.helix_url}/users?login={username}"
         json = self._call_api(url)
         data: UserInfo = json["data"][0]  # type: ignore
 
@@ -167,7 +210,7 @@ class TwitchApi:
         else:
             from_id = None
 
-        url = f"https://api.twitch.tv/helix/users/follows?to_id={to_id}&from_id={from_id}"
+        url = f"{self.helix_url}/users/follows?to_id={to_id}&from_id={from_id}"
         followers: List[FollowingInfo] = self._pagination(url)  # type: ignore
         return followers
 
@@ -185,7 +228,7 @@ class TwitchApi:
         else:
             from_id = None
 
-        url = f"https://api.twitch.tv/helix/users/follows?to_id={to_id}&from_id={from_id}"
+        url = f"{self.helix_url}/users/follows?to_id={to_id}&from_id={from_id}"
         data = self._call_api(url)
         return data["total"]
 
@@ -193,7 +236,7 @@ class TwitchApi:
         """
         Information about a stream.
         """
-        url = f"https://api.twitch.tv/helix/streams?user_login={streamer_name}"
+        url = f"{self.helix_url}/streams?user_login={streamer_name}"
         data = self._call_api(url)
         if len(data["data"]) == 0:
             raise StreamerNotLiveError(f"The requested streamer {streamer_name} is not live, and we can not get their info.")
@@ -205,7 +248,7 @@ class TwitchApi:
         """
         Get the name of a game from it's id.
         """
-        url = f"https://api.twitch.tv/helix/games?id={game_id}"
+        url = f"{self.helix_url}/games?id={game_id}"
         data = self._call_api(url)
         name: str = data["data"][0]["name"]  # type: ignore
         return name
@@ -1,41 +1,225 @@
+import importlib
+import os
+import sys
+import threading
+import time
 import traceback
-from typing import Callable, List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional, Tuple, TYPE_CHECKING
 
 from .twitch_core import TwitchCore
-from .twitch_api import TwitchApi
 from .utils import check_type
-from .data_types import Message, Context, Command
-from .errors import CommandNotFoundError
+from .data_types import Message, Context, Command, ProcessCommand, Cog
+from .errors import CommandNotFoundError, CogNotLoadedError
+from .metrics import Counter, Histogram, REGISTRY
+from .scheduler import Scheduler, Timer
+from .tracing import TRACER
+
+# imported when first used, so starting the bot does not wait on them
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor  # noqa
+    from .analytics import ChatAnalytics  # noqa
+    from .chat_log import ChatRecorder  # noqa
+    from http.server import HTTPServer  # noqa
+    from .twitch_api import TwitchApi  # noqa
+
+DISPATCH_SECONDS = Histogram("pytwitch_dispatch_seconds", "Time spent handling a message in the main loop.")
+EVENT_ERRORS = Counter("pytwitch_event_errors_total", "Exceptions raised while handling a message.")
+COMMANDS_NOT_FOUND = Counter("pytwitch_commands_not_found_total", "Messages starting with the prefix that matched no command.")
 
 
 class TwitchBot(TwitchCore):
-    def __init__(self, *, prefix: str = "!", client_id: Optional[str] = None, api_retry_limit: int = 5):
+    def __init__(self,
+                 *,
+                 prefix: str = "!",
+                 client_id: Optional[str] = None,
+                 api_retry_limit: int = 5,
+                 helix_url: Optional[str] = None,
+                 tmi_url: Optional[str] = None
+                 ):
         super().__init__()
         self.commands: Dict[str, Command] = {}
+        self.process_pools: Dict[str, "ProcessPoolExecutor"] = {}
+        self.cogs: Dict[str, Cog] = {}
+        self.analytics: Optional["ChatAnalytics"] = None
+        self.scheduler = Scheduler()
+        self.scheduler.on_error = lambda timer, e: self.event_task_error(timer, e)
+        self._chat_flush_timer: Optional[Timer] = None
+
+        # the cog whose setup function is running on each thread, see _loading_cog
+        self._cog_local = threading.local()
+        self._cog_lock = threading.RLock()
 
         check_type("prefix", prefix, str)
         self.prefix = prefix
-        self.api = TwitchApi(client_id, api_retry_limit)
+
+        if api_retry_limit <= 0:
+            raise ValueError("api_retry_limit must be positiv.")
+        self._client_id = client_id
+        self._api_retry_limit = api_retry_limit
+        self._api_urls: Dict[str, str] = {}
+        if helix_url is not None:
+            self._api_urls["helix_url"] = helix_url
+        if tmi_url is not None:
+            self._api_urls["tmi_url"] = tmi_url
+        self._api: Optional["TwitchApi"] = None
+
+    @property
+    def api(self) -> "TwitchApi":
+        """
+        The twitch api client, created the first time it is used.
+        """
+        if self._api is None:
+            from .twitch_api import TwitchApi
+            self._api = TwitchApi(self._client_id, self._api_retry_limit, **self._api_urls)
+        return self._api
+
+    @property
+    def _loading_cog(self) -> Optional[Cog]:
+        """
+        The cog whose setup function is running on this thread.
+
+        Cogs can be reloaded from the watcher thread, while commands keep running on the main thread.
+        """
+        cog: Optional[Cog] = getattr(self._cog_local, "cog", None)
+        return cog
+
+    @_loading_cog.setter
+    def _loading_cog(self, cog: Optional[Cog]) -> None:
+        self._cog_local.cog = cog
 
     def run(self) -> None:
         """
         Run the bots main loop.
         """
-        while True:
-            message = self.read_message()
+        try:
+            while True:
+                # timers run between messages, so wait for chat only until the next one is due
+                self.scheduler.run_pending()
+                message = self.read_message(self.scheduler.timeout())
+                if message is None:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    self.event_message(message)
+                except Exception as e:
+                    EVENT_ERRORS.inc()
+                    self.event_error(message, e)
+                end = time.perf_counter()
+                DISPATCH_SECONDS.observe(end - start)
+
+                if TRACER.enabled:
+                    TRACER.record("dispatch", start, end, args={"channel": message.channel.name})
+                    TRACER.end_trace()
+
+                # after dispatching, so a message analytics can not handle still gets to the handlers
+                if self.analytics is not None:
+                    try:
+                        self.analytics.add(message)
+                    except Exception as e:
+                        EVENT_ERRORS.inc()
+                        self.event_error(message, e)
+        finally:
+            # write out the chat still buffered, so it is not lost when the bot stops
+            if self.chat_recorder is not None:
+                self.chat_recorder.close()
+
+    def every(self,
+              interval: float,
+              func: Callable[..., None],
+              *args: Any,
+              delay: Optional[float] = None,
+              jitter: float = 0.0,
+              misfire: str = "coalesce",
+              grace: float = 1.0
+              ) -> Timer:
+        """
+        Call func(*args) every interval seconds in the main loop, the first time after delay seconds.
+
+        Each run happens up to jitter seconds later than due, at random, so many timers started at once spread out.
+        misfire decides what happens when the loop was busy and runs were missed:
+        "coalesce" runs once, "catch_up" runs once for every missed run,
+        and "skip" drops runs more than grace seconds late.
+
+        Returns a Timer, call its cancel method to stop it.
+        Timers created in the setup function of a cog are cancelled when the cog is unloaded.
+        """
+        timer = self.scheduler.every(interval, func, *args, delay=delay, jitter=jitter, misfire=misfire, grace=grace)
+        return self._track_timer(timer)
+
+    def after(self, delay: float, func: Callable[..., None], *args: Any, **options: Any) -> Timer:
+        """
+        Call func(*args) once, after delay seconds. Takes the same options as every.
+        """
+        return self._track_timer(self.scheduler.after(delay, func, *args, **options))
 
-            try:
-                self.event_message(message)
-            except Exception as e:
-                self.event_error(message, e)
+    def at(self, when: float, func: Callable[..., None], *args: Any, **options: Any) -> Timer:
+        """
+        Call func(*args) once, at the unix timestamp when. Takes the same options as every.
+        """
+        return self._track_timer(self.scheduler.at(when, func, *args, **options))
 
-    def _import_cog(self, current_object: object, import_paths: List[str]) -> object:
-        if len(import_paths) == 0:
-            return current_object
+    def _track_timer(self, timer: Timer) -> Timer:
+        if self._loading_cog is not None:
+            self._loading_cog.timers.append(timer)
+        return timer
 
-        attr = import_paths.pop(0)
-        current_object = getattr(current_object, attr)
-        return self._import_cog(current_object, import_paths)
+    def record_chat(self,
+                    directory: str,
+                    segment_size: Optional[int] = None,
+                    flush_interval: float = 1.0
+                    ) -> "ChatRecorder":
+        """
+        Record every chat message the bot reads to a chat log in directory.
+
+        The log is flushed every flush_interval seconds, so people reading it see chat that much later at most.
+        See PyTwitch.chat_log for reading it back.
+        """
+        if self._chat_flush_timer is not None:
+            self._chat_flush_timer.cancel()
+
+        recorder = super().record_chat(directory, segment_size)
+        # not a timer of the cog that may be loading, the recorder outlives it
+        self._chat_flush_timer = self.scheduler.every(flush_interval, recorder.flush)
+        return recorder
+
+    def enable_analytics(self, window: float = 3600.0, precision: int = 10, top: int = 10) -> None:
+        """
+        Keep statistics of every channel, read them from the channel objects.
+
+        Unique chatters are counted over the last window seconds, with a error around 1.04 / sqrt(2 ** precision).
+        top is how many of the most used emotes and commands are remembered.
+        """
+        from .analytics import ChatAnalytics
+
+        # the emotes are only sent in the message tags
+        self.request_capability("twitch.tv/tags")
+        self.analytics = ChatAnalytics(self.prefix, window, precision, top)
+
+    def enable_tracing(self, sample_rate: float = 1.0, max_spans: int = 100_000) -> None:
+        """
+        Trace a share of the messages the bot handles, 1.0 traces all of them.
+
+        Only the newest max_spans spans are kept, write them to a file with export_trace.
+        """
+        TRACER.configure(sample_rate, max_spans)
+
+    def export_trace(self, path: str) -> None:
+        """
+        Write the traced messages to path in the chrome trace event format.
+
+        The file can be opened in https://ui.perfetto.dev
+        """
+        TRACER.export(path)
+
+    def serve_metrics(self, port: int = 9100, host: str = "127.0.0.1") -> "HTTPServer":
+        """
+        Serve the bots metrics in the prometheus text format over http.
+
+        The server runs in a background thread, and listens on localhost unless another host is given.
+        """
+        check_type("port", port, int)
+        return REGISTRY.serve(port, host)
 
     def load_cog(self, cog_name: str) -> None:
         """
@@ -51,11 +235,139 @@ class TwitchBot(TwitchCore):
             @bot.command()
             def test(ctx):
                 ctx.reply("Hello World!")
+
+        A cog can also have a teardown function, that is run when it is unloaded.
+        """
+        with self._cog_lock:
+            if cog_name in self.cogs:
+                raise ValueError(f"Cog {cog_name} is already loaded")
+
+            module = importlib.import_module(cog_name)
+            self._setup_cog(Cog(cog_name, module))
+
+    def unload_cog(self, cog_name: str) -> None:
+        """
+        Unload a cog, removing every command, event, process pool and timer it registered.
+        """
+        with self._cog_lock:
+            cog = self.cogs.get(cog_name)
+            if cog is None:
+                raise CogNotLoadedError(f"Cog {cog_name} is not loaded")
+
+            teardown = getattr(cog.module, "teardown", None)
+            if teardown is not None:
+                teardown(self)
+
+            self.commands = {
+                    name: command for name, command in self.commands.items()
+                    if cog.commands.get(name) is not command
+                    }
+            self._remove_cog_extras(cog)
+            del self.cogs[cog_name]
+            sys.modules.pop(cog_name, None)
+
+    def reload_cog(self, cog_name: str) -> None:
         """
-        cog: object = __import__(cog_name)
-        import_path = cog_name.split(".")[1:]
-        cog = self._import_cog(cog, import_path)
-        cog.setup(self)  # type: ignore
+        Reload a cog from its file, without reconnecting.
+
+        The old teardown function runs first, since the new code runs in the same module.
+        The old commands keep working until the new setup function has finished,
+        if it raises they stay loaded, but the old teardown has already run.
+        """
+        with self._cog_lock:
+            old_cog = self.cogs.get(cog_name)
+            if old_cog is None:
+                raise CogNotLoadedError(f"Cog {cog_name} is not loaded")
+
+            teardown = getattr(old_cog.module, "teardown", None)
+            if teardown is not None:
+                teardown(self)
+
+            module = importlib.reload(old_cog.module)
+            self._setup_cog(Cog(cog_name, module))
+
+    def watch_cogs(self, interval: float = 1.0) -> None:
+        """
+        Start a thread that reloads cogs when their file changes.
+        """
+        def watch() -> None:
+            modified: Dict[str, float] = {}
+            while True:
+                for cog_name, cog in list(self.cogs.items()):
+                    path = getattr(cog.module, "__file__", None)
+                    if path is None:
+                        continue
+
+                    try:
+                        mtime = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+
+                    if modified.setdefault(cog_name, mtime) != mtime:
+                        modified[cog_name] = mtime
+                        try:
+                            self.reload_cog(cog_name)
+                        except Exception:
+                            traceback.print_exc()
+
+                time.sleep(interval)
+
+        threading.Thread(target=watch, name="cog-watcher", daemon=True).start()
+
+    def _setup_cog(self, cog: Cog) -> None:
+        """
+        Run the setup function of a cog, and install what it registered.
+
+        Everything is collected on the cog first, and swapped in at once.
+        """
+        self._loading_cog = cog
+        try:
+            cog.module.setup(self)  # type: ignore
+        except Exception:
+            for pool in cog.process_pools.values():
+                pool.shutdown(wait=False)
+            for timer in cog.timers:
+                timer.cancel()
+            raise
+        finally:
+            self._loading_cog = None
+
+        old_cog = self.cogs.get(cog.name)
+        commands = dict(self.commands)
+        if old_cog is not None:
+            for name, command in old_cog.commands.items():
+                if commands.get(name) is command:
+                    del commands[name]
+        commands.update(cog.commands)
+        self.commands = commands
+
+        if old_cog is not None:
+            self._remove_cog_extras(old_cog)
+
+        for event_name, func in cog.events.items():
+            cog.replaced_events[event_name] = self.__dict__.get(event_name)
+            setattr(self, event_name, func)
+
+        self.process_pools.update(cog.process_pools)
+        self.cogs[cog.name] = cog
+
+    def _remove_cog_extras(self, cog: Cog) -> None:
+        """
+        Restore the events a cog replaced, close its process pools and cancel its timers.
+        """
+        for timer in cog.timers:
+            timer.cancel()
+
+        for event_name, previous in cog.replaced_events.items():
+            if previous is None:
+                self.__dict__.pop(event_name, None)
+            else:
+                setattr(self, event_name, previous)
+
+        for pool_name, pool in cog.process_pools.items():
+            if self.process_pools.get(pool_name) is pool:
+                del self.process_pools[pool_name]
+            pool.shutdown(wait=False)
 
     def process_message(self, message: Message) -> None:
         """
@@ -68,6 +380,7 @@ class TwitchBot(TwitchCore):
             command_name, *arguments = message.content[len(self.prefix):].split(" ")
             command = self.commands.get(command_name)
             if command is None:
+                COMMANDS_NOT_FOUND.inc()
                 raise CommandNotFoundError(f"Command {command_name} not found")
 
             ctx = Context(message)
@@ -75,25 +388,113 @@ class TwitchBot(TwitchCore):
 
     def command(self,
                 command_name: Optional[str] = None,
-                aliases: List[str] = []
-                ) -> Callable[[Callable[..., None]], None]:
+                aliases: List[str] = [],
+                pool: Optional[str] = None
+                ) -> Callable[[Callable[..., None]], Callable[..., None]]:
 
         """
         Register a function as a command.
+
+        If pool is given the command runs in that process pool, see process_pool.
         """
-        def Decorator(func: Callable[..., None]) -> None:
+        if pool is not None and self._get_process_pool(pool) is None:
+            raise ValueError(f"No process pool named {pool}")
+
+        def Decorator(func: Callable[..., None]) -> Callable[..., None]:
             if command_name is None:
                 inner_command_name: str = func.__name__
             else:
                 inner_command_name = command_name
 
-            command = Command(func)
-            self.commands[inner_command_name] = command
+            command: Command
+            if pool is None:
+                command = Command(func, inner_command_name)
+            else:
+                command = ProcessCommand(func, self._get_process_pool(pool), inner_command_name)  # type: ignore
+
+            if self._loading_cog is not None:
+                commands = self._loading_cog.commands
+            else:
+                commands = self.commands
+
+            commands[inner_command_name] = command
             for alias in aliases:
-                self.commands[alias] = command
+                commands[alias] = command
+
+            return func
 
         return Decorator
 
+    def process_pool(self,
+                     pool_name: str,
+                     workers: Optional[int] = None,
+                     initializer: Optional[Callable[..., None]] = None,
+                     initargs: Tuple[Any, ...] = ()
+                     ) -> None:
+        """
+        Create a named pool of worker processes for cpu heavy commands.
+
+        The workers are started right away, running initializer once in each of them,
+        so a cog can load models or other data before the first command comes in.
+        If workers is not given it will default to the number of cpus.
+
+        Commands running in a pool get a ContextSnapshot instead of a Context,
+        and must be defined at the top level of their module:
+
+        def markov(ctx, *words):
+            ctx.reply(generate(words))
+
+        def setup(bot):
+            bot.process_pool("markov", workers=4, initializer=load_model)
+            bot.command(pool="markov")(markov)
+        """
+        check_type("pool_name", pool_name, str)
+        if self._pool_name_taken(pool_name):
+            raise ValueError(f"Process pool {pool_name} already exists")
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        from concurrent.futures import ProcessPoolExecutor, wait
+
+        pool = ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs)
+        # the executor only spawns a worker when there is work for it,
+        # so give every worker something to do.
+        wait([pool.submit(os.getpid) for _ in range(workers)])
+
+        if self._loading_cog is not None:
+            self._loading_cog.process_pools[pool_name] = pool
+        else:
+            self.process_pools[pool_name] = pool
+
+    def _pool_name_taken(self, pool_name: str) -> bool:
+        """
+        Check if a pool name is in use, a cog being reloaded may reuse the names of its old pools.
+        """
+        cog = self._loading_cog
+        if cog is None:
+            return pool_name in self.process_pools
+        if pool_name in cog.process_pools:
+            return True
+
+        old_cog = self.cogs.get(cog.name)
+        if old_cog is not None and pool_name in old_cog.process_pools:
+            return False
+        return pool_name in self.process_pools
+
+    def _get_process_pool(self, pool_name: str) -> Optional["ProcessPoolExecutor"]:
+        if self._loading_cog is not None and pool_name in self._loading_cog.process_pools:
+            return self._loading_cog.process_pools[pool_name]
+        return self.process_pools.get(pool_name)
+
+    def close_process_pools(self) -> None:
+        """
+        Shut down all the process pools, waiting for running commands to finish.
+        """
+        for pool in self.process_pools.values():
+            pool.shutdown()
+        self.process_pools.clear()
+
     def event(self, func: Callable[..., None]) -> None:
         """
         Register a function as a event handler.
@@ -107,10 +508,16 @@ class TwitchBot(TwitchCore):
         if not hasattr(self, event_name):
             raise AttributeError(f"TwitchBot has no event {event_name}")
 
-        setattr(self, event_name, func)
+        if self._loading_cog is not None:
+            self._loading_cog.events[event_name] = func
+        else:
+            setattr(self, event_name, func)
 
     def event_error(self, message: Message, e: Exception) -> None:
         traceback.print_exc()
 
+    def event_task_error(self, timer: Timer, e: Exception) -> None:
+        traceback.print_exc()
+
     def event_message(self, message: Message) -> None:
         self.process_message(message)
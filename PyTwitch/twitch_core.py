@@ -1,25 +1,132 @@
-from typing import List
+from collections import deque
+import time
+from typing import Deque, List, Optional, Tuple, TYPE_CHECKING
 
 from .irc_protocol import IrcProtocol
 
-from .utils import check_type
+from .utils import JOIN_LIMIT, RateLimiter, check_type
 from .data_types import Channel, Message, User
+from .metrics import Counter, Histogram
+from .tracing import TRACER
+
+if TYPE_CHECKING:
+    from .chat_log import ChatRecorder  # noqa
+
+MESSAGES_PARSED = Counter("pytwitch_messages_parsed_total", "Chat messages parsed from irc lines.")
+PARSE_SECONDS = Histogram("pytwitch_parse_seconds", "Time spent parsing a chat message.",
+                          buckets=(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.001))
+RECONNECTS = Counter("pytwitch_reconnects_total", "Times the bot reconnected to twitch.")
+RECONNECT_FAILURES = Counter("pytwitch_reconnect_failures_total", "Reconnect attempts that failed and were retried.")
+MESSAGES_SENT = Counter("pytwitch_messages_sent_total", "Chat messages sent.")
+SEND_SECONDS = Histogram("pytwitch_send_seconds", "Time spent sending a chat message, including waiting for the socket.")
+
+# seconds to wait before retrying a failed reconnect, doubling every failure up to the max
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
 
 
 class TwitchCore:
     def __init__(self) -> None:
         self._irc = IrcProtocol()
         self.channels: List[Channel] = []
+        self._login: Optional[Tuple[str, str, str, int]] = None
+        self.chat_recorder: Optional["ChatRecorder"] = None
+
+        # channels to join again after reconnecting, sent slowly enough to stay under twitch's join limit.
+        # the window has a second of margin, twitch sees the joins a bit after they are sent.
+        self._pending_joins: Deque[str] = deque()
+        self._join_limiter = RateLimiter((JOIN_LIMIT[0], JOIN_LIMIT[1] + 1.0))
+
+        # IRCv3 capabilities requested when connecting, see request_capability
+        self.capabilities: List[str] = []
 
-    def connect(self, username: str, password: str) -> None:
+    def connect(self, username: str, password: str, host: str = "irc.twitch.tv", port: int = 6667) -> None:
         """
         Connect to twitch using username and password.
+
+        host and port can be changed to connect to something other than twitch, like a local test server.
         """
         check_type("username", username, str)
         check_type("password", password, str)
+        check_type("host", host, str)
+        check_type("port", port, int)
 
-        self._irc.connect("irc.twitch.tv", 6667)
+        self._irc.connect(host, port)
+        if self.capabilities:
+            self._irc.request_capabilities(self.capabilities)
         self._irc.login(username, password)
+        self._login = (username, password, host, port)
+
+    def reconnect(self) -> None:
+        """
+        Open a new connection to twitch, and join the channels again.
+
+        This is done when twitch sends a RECONNECT, or closes the connection.
+        The channels are joined while reading messages, as fast as the join limit allows.
+        If the connection fails it is retried until it works, waiting longer after every failure.
+        """
+        if self._login is None:
+            raise ConnectionError("Can not reconnect before connecting")
+
+        username, password, host, port = self._login
+        delay = RECONNECT_DELAY
+        while True:
+            self._irc.close()
+            self._irc = IrcProtocol()
+            try:
+                self._irc.connect(host, port)
+                if self.capabilities:
+                    self._irc.request_capabilities(self.capabilities)
+                self._irc.login(username, password)
+                break
+            except OSError:
+                RECONNECT_FAILURES.inc()
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+        self._pending_joins = deque(channel.name for channel in self.channels)
+        self._join_pending()
+        RECONNECTS.inc()
+
+    def _join_pending(self) -> Optional[float]:
+        """
+        Join the channels waiting to be joined again, as many as the join limit allows.
+
+        return how many seconds until the next one can be joined, or None if there are none left.
+        """
+        while self._pending_joins:
+            now = time.monotonic()
+            if not self._join_limiter.allow(now):
+                return self._join_limiter.wait(now)
+            self._irc.join_channel(self._pending_joins.popleft())
+        return None
+
+    def request_capability(self, capability: str) -> None:
+        """
+        Ask twitch for a IRCv3 capability, like twitch.tv/tags for the emotes, badges and more of each message.
+
+        It is requested right away if the bot is connected, and again every time it connects.
+        """
+        check_type("capability", capability, str)
+        if capability in self.capabilities:
+            return
+
+        self.capabilities.append(capability)
+        if self._login is not None:
+            self._irc.request_capabilities([capability])
+
+    def record_chat(self, directory: str, segment_size: Optional[int] = None) -> "ChatRecorder":
+        """
+        Record every chat message the bot reads to a chat log in directory.
+
+        See PyTwitch.chat_log for reading it back.
+        """
+        from .chat_log import ChatRecorder, DEFAULT_SEGMENT_SIZE
+
+        if self.chat_recorder is not None:
+            self.chat_recorder.close()
+        self.chat_recorder = ChatRecorder(directory, segment_size or DEFAULT_SEGMENT_SIZE)
+        return self.chat_recorder
 
     def join_channel(self, channel_name: str) -> Channel:
         """
@@ -44,27 +151,82 @@ class TwitchCore:
         message = str(message)
         check_type("channel_name", channel_name, str)
 
+        start = time.perf_counter()
         self._irc.send_message(channel_name, message)
+        end = time.perf_counter()
+        SEND_SECONDS.observe(end - start)
+        MESSAGES_SENT.inc()
+        if TRACER.enabled:
+            TRACER.record("send", start, end)
 
-    def read_message(self) -> Message:
+    def read_message(self, timeout: Optional[float] = None) -> Optional[Message]:
         """
         Reads message from twitch
-        """
 
+        If timeout is given, returns None if no message arrived in that many seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
         while True:
-            data = self._irc.read()
-            # print(data)
-            if "PRIVMSG" in data:
-                # This is a message, let's parse it!
-                # messages are in this format:
-                # :<user>!<user>@<user>.tmi.twitch.tv PRIVMSG #<channel> :This is a sample message
-
-                data = data[1:]
-                user_name = data.split("!")[0]
-                channel_name = data.split("#")[1].split(":")[0][:-1]
-                message_parts = data.split(":")[1:]
-                message_content = ":".join(message_parts)
-
-                channel = Channel(channel_name, self)  # type: ignore
-                user = User(user_name, channel, self)  # type: ignore
-                return Message(user, channel, message_content)
+            read_timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            join_wait = self._join_pending() if self._pending_joins else None
+            if join_wait is not None and (read_timeout is None or join_wait < read_timeout):
+                read_timeout = join_wait
+
+            tracing = TRACER.enabled
+            start = time.perf_counter() if tracing else 0.0
+            try:
+                data = self._irc.read(read_timeout)
+            except ConnectionError:
+                self.reconnect()
+                continue
+            if data is None:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                continue
+            read_end = time.perf_counter() if tracing else 0.0
+
+            message = self.parse_message(data)
+            if message is None:
+                continue
+
+            if self.chat_recorder is not None:
+                self.chat_recorder.record(data, message.channel.name, message.user.name)
+
+            # only the read of the line holding the message is part of the trace
+            if tracing and TRACER.start_trace() is not None:
+                TRACER.record("read", start, read_end)
+                TRACER.record("parse", read_end, time.perf_counter())
+            return message
+
+    def parse_message(self, data: str) -> Optional[Message]:
+        """
+        Parse one line from twitch.
+
+        return None if the line is not a chat message.
+        """
+        if "PRIVMSG" not in data:
+            return None
+
+        start = time.perf_counter()
+        # This is a message, let's parse it!
+        # messages are in this format:
+        # @<tags> :<user>!<user>@<user>.tmi.twitch.tv PRIVMSG #<channel> :This is a sample message
+        # the tags are only there if we requested them, and are parsed when they are used.
+
+        tags = ""
+        if data.startswith("@"):
+            tags, data = data[1:].split(" ", 1)
+
+        data = data[1:]
+        user_name = data.split("!")[0]
+        channel_name = data.split("#")[1].split(":")[0][:-1]
+        message_parts = data.split(":")[1:]
+        message_content = ":".join(message_parts)
+
+        channel = Channel(channel_name, self)  # type: ignore
+        user = User(user_name, channel, self)  # type: ignore
+        message = Message(user, channel, message_content, tags)
+
+        PARSE_SECONDS.observe(time.perf_counter() - start)
+        MESSAGES_PARSED.inc()
+        return message
@@ -1,3 +1,14 @@
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+# max messages and the time window in seconds they are counted over
+RateLimit = Tuple[int, float]
+
+# what twitch allows a normal user, moderators may send 100 messages per 30 seconds.
+CHAT_LIMIT: RateLimit = (20, 30.0)
+JOIN_LIMIT: RateLimit = (20, 10.0)
+
+
 def check_type(name: str, value: any, should_be: type) -> None:  # type: ignore
     """
     Check that the passed in value is the correct type, if not raise TypeError.
@@ -5,3 +16,42 @@ def check_type(name: str, value: any, should_be: type) -> None:  # type: ignore
     if not isinstance(value, should_be):
         raise TypeError(f"{name} must be type {should_be.__name__}, "
                         "but got {type(value)}")
+
+
+class RateLimiter:
+    """
+    A sliding window rate limit, like twitch uses.
+    """
+    def __init__(self, limit: Optional[RateLimit]) -> None:
+        self.limit = limit
+        self._times: Deque[float] = deque()
+
+    def _expire(self, now: float) -> None:
+        if self.limit is not None:
+            while self._times and self._times[0] <= now - self.limit[1]:
+                self._times.popleft()
+
+    def allow(self, now: float) -> bool:
+        """
+        Count a event at now, return False without counting it if it is over the limit.
+        """
+        if self.limit is None:
+            return True
+
+        self._expire(now)
+        if len(self._times) >= self.limit[0]:
+            return False
+        self._times.append(now)
+        return True
+
+    def wait(self, now: float) -> float:
+        """
+        Seconds until allow will return True.
+        """
+        if self.limit is None:
+            return 0.0
+
+        self._expire(now)
+        if len(self._times) < self.limit[0]:
+            return 0.0
+        return self._times[0] + self.limit[1] - now
@@ -0,0 +1,92 @@
+"""
+IRC corpora for the benchmarks, generated from a fixed seed so every run sees the same lines.
+
+Each corpus is a list of raw irc lines, as twitch sends them with the tags capability on.
+"""
+import random
+import zlib
+from typing import Callable, Dict, List
+
+from PyTwitch.fake_twitch import SAMPLE_EMOTES, SAMPLE_WORDS, emote_tag, format_privmsg, recorded_chat
+
+MULTI_BYTE_WORDS = ["こんにちは", "ありがとう", "привет", "спасибо", "안녕하세요", "😂", "🔥", "👀", "ñandú", "größe"]
+
+
+def _message(rng: random.Random, channel: str, user: str, words: List[str], length: int) -> str:
+    text = " ".join(rng.choice(words) for _ in range(length))
+    tags = {
+            "badge-info": "",
+            "badges": rng.choice(["", "subscriber/12", "moderator/1,subscriber/3", "vip/1"]),
+            "color": rng.choice(["#FF0000", "#1E90FF", ""]),
+            "display-name": user,
+            "emotes": emote_tag(text),
+            "id": f"{rng.getrandbits(64):016x}",
+            "mod": "0",
+            "room-id": str(zlib.crc32(channel.encode())),
+            "subscriber": "0",
+            "tmi-sent-ts": str(1_600_000_000_000 + rng.randrange(10 ** 9)),
+            "turbo": "0",
+            "user-id": str(rng.randrange(10 ** 8)),
+            "user-type": ""
+            }
+    return format_privmsg(channel, user, text, tags)
+
+
+def quiet_channel(lines: int = 2000, seed: int = 1) -> List[str]:
+    """
+    A small channel, a handful of regulars writing short messages.
+    """
+    rng = random.Random(seed)
+    return [_message(rng, "quietstream", f"regular{rng.randrange(8)}", SAMPLE_WORDS, rng.randint(2, 8))
+            for _ in range(lines)]
+
+
+def emote_spam(lines: int = 2000, seed: int = 2) -> List[str]:
+    """
+    A big channel during a hype moment, most messages are repeated emotes.
+    """
+    rng = random.Random(seed)
+    emotes = list(SAMPLE_EMOTES)
+    return [_message(rng, "bigstream", f"viewer{rng.randrange(20_000)}", emotes, rng.randint(1, 20))
+            for _ in range(lines)]
+
+
+def raid_burst(lines: int = 2000, seed: int = 3) -> List[str]:
+    """
+    Thousands of new chatters posting the raid message at once, with commands mixed in.
+    """
+    rng = random.Random(seed)
+    result: List[str] = []
+    for index in range(lines):
+        user = f"raider{index}"
+        if index % 10 == 0:
+            tags = {"display-name": user, "emotes": ""}
+            result.append(format_privmsg("raidedstream", user, rng.choice(["!uptime", "!so raider", "!followage"]), tags))
+        else:
+            result.append(_message(rng, "raidedstream", user, ["RAID", "HYPE", "PogChamp", "Kappa"], rng.randint(3, 10)))
+    return result
+
+
+def long_multi_byte(lines: int = 2000, seed: int = 4) -> List[str]:
+    """
+    Messages close to twitch's 500 character limit, in several scripts.
+    """
+    rng = random.Random(seed)
+    words = MULTI_BYTE_WORDS + SAMPLE_WORDS
+    return [_message(rng, "internationalstream", f"chatter{rng.randrange(500)}", words, rng.randint(60, 90))
+            for _ in range(lines)]
+
+
+CORPORA: Dict[str, Callable[[], List[str]]] = {
+        "quiet_channel": quiet_channel,
+        "emote_spam": emote_spam,
+        "raid_burst": raid_burst,
+        "long_multi_byte": long_multi_byte
+        }
+
+
+def load_corpus(path: str) -> List[str]:
+    """
+    A recorded corpus, either a file with one raw irc line per line or a chat log directory.
+    """
+    return list(recorded_chat(path, loop=False))
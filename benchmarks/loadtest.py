@@ -0,0 +1,225 @@
+"""
+Load test a TwitchBot against the fake twitch servers from PyTwitch.fake_twitch.
+
+Run it from the root of the repo:
+    python benchmarks/loadtest.py --channels 200 --rate 5000 --duration 10
+
+Chat is replayed into every channel the bot joins, with some of the messages being
+commands the bot answers. It reports how many messages per second the bot parsed,
+how long it took from a command being sent until the reply arrived, and memory use.
+Pass --min-throughput and --max-p99 to fail when the results get worse than that.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyTwitch import TwitchBot  # noqa: E402
+from PyTwitch.fake_twitch import (  # noqa: E402
+        CHAT_LIMIT, JOIN_LIMIT, FakeHelixServer, FakeIrcServer, format_privmsg, recorded_chat, synthetic_chat
+        )
+from PyTwitch.twitch_core import MESSAGES_PARSED, RECONNECTS  # noqa: E402
+
+
+class CommandInjector:
+    """
+    Mixes commands into a stream of chat, remembering when each one was sent.
+
+    The fake server pulls lines right before sending them, so the time a line is taken is the time it is sent.
+    """
+    def __init__(self, lines: Iterator[str], channels: List[str], every: int, api_every: int) -> None:
+        self.lines = lines
+        self.channels = channels
+        self.every = every
+        self.api_every = api_every
+        self.sent_at: Dict[str, float] = {}
+
+    def __iter__(self) -> Iterator[str]:
+        for index in itertools.count():
+            if self.every and index % self.every == 0:
+                seq = str(index)
+                command = "game" if self.api_every and index % (self.every * self.api_every) == 0 else "ping"
+                channel = self.channels[index % len(self.channels)]
+                self.sent_at[seq] = time.perf_counter()
+                yield format_privmsg(channel, "loadtester", f"!{command} {seq}")
+            else:
+                yield next(self.lines)
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def make_bot(irc: FakeIrcServer, helix: FakeHelixServer, channels: List[str]) -> TwitchBot:
+    bot = TwitchBot(client_id="loadtest", helix_url=helix.helix_url, tmi_url=helix.tmi_url)
+
+    @bot.command()
+    def ping(ctx: Any, seq: str) -> None:
+        ctx.reply(f"pong {seq}")
+
+    @bot.command()
+    def game(ctx: Any, seq: str) -> None:
+        ctx.reply(f"pong {seq} {ctx.channel.stream.game}")
+
+    bot.connect("loadtest", "oauth:loadtest", host=irc.host, port=irc.port)
+    for channel in channels:
+        bot.join_channel(channel)
+
+    return bot
+
+
+def wait_for_joins(irc: FakeIrcServer, count: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if irc.clients and len(irc.clients[0].channels) >= count:
+            return
+        time.sleep(0.01)
+    raise TimeoutError(f"The bot did not join {count} channels in time")
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.replay is not None:
+        lines = recorded_chat(args.replay)
+        recorded = itertools.islice(recorded_chat(args.replay, loop=False), 100_000)
+        channels = sorted({line.split(" #", 1)[1].split(" ", 1)[0] for line in recorded if " #" in line})
+    else:
+        channels = [f"channel{index}" for index in range(args.channels)]
+        lines = synthetic_chat(channels)
+
+    injector = CommandInjector(lines, channels, args.command_every, args.api_every)
+    irc = FakeIrcServer(
+            injector,
+            rate=args.rate,
+            chat_limit=CHAT_LIMIT if args.enforce_limits else None,
+            join_limit=JOIN_LIMIT if args.enforce_limits else None,
+            ping_interval=args.ping_interval,
+            reconnect_after=args.reconnect_after
+            ).start()
+    helix = FakeHelixServer(latency=args.api_latency / 1000, ratelimit_rate=args.api_429_rate).start()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    bot = make_bot(irc, helix, channels)
+    # joins over the limit are dropped, the bot would not get chat from those channels
+    if not args.enforce_limits:
+        wait_for_joins(irc, len(channels))
+
+    threading.Thread(target=bot.run, name="bot", daemon=True).start()
+    irc.start_replay()
+
+    parsed_before = MESSAGES_PARSED.value
+    reconnects_before = RECONNECTS.value
+    start = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - start
+    parsed = int(MESSAGES_PARSED.value - parsed_before)
+
+    latencies: List[float] = []
+    for reply_time, _, text in list(irc.replies):
+        parts = text.split(" ")
+        sent_at = injector.sent_at.get(parts[1]) if len(parts) > 1 and parts[0] == "pong" else None
+        if sent_at is not None:
+            latencies.append((reply_time - sent_at) * 1000)
+
+    results: Dict[str, Any] = {
+            "channels": len(channels),
+            "duration_s": elapsed,
+            "lines_sent": irc.lines_sent,
+            "messages_parsed": parsed,
+            "throughput_msg_s": parsed / elapsed,
+            "commands_sent": len(injector.sent_at),
+            "replies": len(latencies),
+            "latency_ms": {
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p99": percentile(latencies, 0.99),
+                "max": max(latencies, default=float("nan"))
+                },
+            "reconnects": int(RECONNECTS.value - reconnects_before),
+            "pongs": irc.pongs,
+            "limit_violations": dict(irc.limit_violations),
+            "api_requests": sum(helix.requests.values()),
+            "api_ratelimited": helix.ratelimited,
+            "max_rss_kb": max_rss_kb()
+            }
+
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        results["traced_memory_kb"] = {"current": current // 1024, "peak": peak // 1024}
+
+    # the servers are left running, stopping them would make the bot try to reconnect while exiting
+    return results
+
+
+def max_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macos reports bytes, linux kilobytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=100, help="channels to join, ignored with --replay")
+    parser.add_argument("--rate", type=float, default=2000, help="chat lines sent per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run for")
+    parser.add_argument("--replay", help="a file of raw irc lines to replay instead of random chat")
+    parser.add_argument("--command-every", type=int, default=50, help="every n-th line is a command, 0 for none")
+    parser.add_argument("--api-every", type=int, default=10, help="every n-th command calls the api, 0 for none")
+    parser.add_argument("--api-latency", type=float, default=0, help="added api latency in ms")
+    parser.add_argument("--api-429-rate", type=float, default=0, help="share of api calls that get a 429")
+    parser.add_argument("--ping-interval", type=float, default=5, help="seconds between PINGs")
+    parser.add_argument("--reconnect-after", type=float, help="send a RECONNECT after this many seconds")
+    parser.add_argument("--enforce-limits", action="store_true", help="drop messages and joins over twitch's limits")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report python allocations, slows the bot down")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--min-throughput", type=float, help="fail if fewer messages per second were parsed")
+    parser.add_argument("--max-p99", type=float, help="fail if the p99 reply latency in ms was higher")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        latency = results["latency_ms"]
+        print(f"channels:           {results['channels']}")
+        print(f"ingest throughput:  {results['throughput_msg_s']:.0f} msg/s "
+              f"({results['messages_parsed']} of {results['lines_sent']} lines)")
+        print(f"replies:            {results['replies']} of {results['commands_sent']} commands")
+        print(f"reply latency (ms): p50 {latency['p50']:.2f}  p90 {latency['p90']:.2f}  "
+              f"p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+        print(f"reconnects:         {results['reconnects']} ({results['pongs']} PONGs)")
+        print(f"limit violations:   {results['limit_violations']}")
+        print(f"api requests:       {results['api_requests']} ({results['api_ratelimited']} got 429)")
+        print(f"max rss:            {results['max_rss_kb']} kB")
+        if "traced_memory_kb" in results:
+            print(f"traced memory:      {results['traced_memory_kb']} kB")
+
+    failed = False
+    if args.min_throughput is not None and results["throughput_msg_s"] < args.min_throughput:
+        print(f"throughput below {args.min_throughput} msg/s", file=sys.stderr)
+        failed = True
+    if args.max_p99 is not None and not results["latency_ms"]["p99"] <= args.max_p99:
+        print(f"p99 latency above {args.max_p99} ms", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Microbenchmarks for the message hot path: framing, parsing, object construction and routing.
+
+Run it from the root of the repo, and compare two runs to find regressions:
+    python benchmarks/micro.py run -o before.json
+    python benchmarks/micro.py run -o after.json
+    python benchmarks/micro.py compare before.json after.json
+
+Every benchmark runs over each corpus from corpora.py, recorded corpora can be added with
+--corpus name=path, where path is a file of raw lines or a chat log directory.
+Times are the best of --repeat passes, in ns per line.
+Allocations are measured with tracemalloc, as the memory blocks and bytes still held per parsed message,
+and the peak memory used while parsing one, which includes the temporary allocations.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpora import CORPORA, load_corpus  # noqa: E402
+from PyTwitch.data_types import Channel, Command, Context, Message, User  # noqa: E402
+from PyTwitch.errors import CommandNotFoundError  # noqa: E402
+from PyTwitch.irc_protocol import IrcProtocol  # noqa: E402
+from PyTwitch.twitch_bot import TwitchBot  # noqa: E402
+
+# a benchmark gets the corpus, and returns a function doing one pass over it and how many lines a pass handles
+Benchmark = Callable[[List[str]], Tuple[Callable[[], None], int]]
+
+
+class _ChunkSocket:
+    """
+    Stands in for a socket, returning the corpus in chunks like recv would.
+    """
+    def __init__(self, chunks: List[bytes]) -> None:
+        self.chunks = chunks
+        self.index = 0
+
+    def recv(self, size: int) -> bytes:
+        chunk = self.chunks[self.index]
+        self.index += 1
+        return chunk
+
+    def sendall(self, data: bytes) -> None:
+        pass
+
+
+def _offline_bot() -> TwitchBot:
+    bot = TwitchBot()
+    # the bot is never connected, so drop what it sends
+    bot._irc.send_message = lambda channel, message: None  # type: ignore
+    return bot
+
+
+def _parsed(bot: TwitchBot, lines: List[str]) -> List[Message]:
+    messages = [bot.parse_message(line) for line in lines]
+    return [message for message in messages if message is not None]
+
+
+def bench_framing(lines: List[str]) -> Tuple[Callable[[], None], int]:
+    data = "".join(line + "\r\n" for line in lines).encode()
+    chunks = [data[index:index + 2048] for index in range(0, len(data), 2048)]
+    irc = IrcProtocol()
+    irc._sock._sock.close()
+
+    def run() -> None:
+        irc._sock._sock = _ChunkSocket(chunks)  # type: ignore
+        irc._sock._decoder.reset()
+        irc._partial = ""
+        for _ in range(len(lines)):
+            irc.read()
+
+    return run, len(lines)
+
+
+def bench_parse(lines: List[str]) -> Tuple[Callable[[], None], int]:
+    bot = _offline_bot()
+
+    def run() -> None:
+        for line in lines:
+            bot.parse_message(line)
+
+    return run, len(lines)
+
+
+def bench_construct(lines: List[str]) -> Tuple[Callable[[], None], int]:
+    bot = _offline_bot()
+    fields = [(message.channel.name, message.user.name, message.content, message.raw_tags)
+              for message in _parsed(bot, lines)]
+
+    def run() -> None:
+        for channel_name, user_name, content, raw_tags in fields:
+            channel = Channel(channel_name, bot)
+            user = User(user_name, channel, bot)
+            Message(user, channel, content, raw_tags)
+
+    return run, len(fields)
+
+
+def bench_route(lines: List[str]) -> Tuple[Callable[[], None], int]:
+    bot = _offline_bot()
+    for name in ["uptime", "so", "followage"]:
+        bot.command(name)(lambda ctx, *args: None)
+    messages = _parsed(bot, lines)
+
+    def run() -> None:
+        for message in messages:
+            try:
+                bot.process_message(message)
+            except CommandNotFoundError:
+                pass
+
+    return run, len(messages)
+
+
+def bench_command_call(lines: List[str]) -> Tuple[Callable[[], None], int]:
+    bot = _offline_bot()
+    command = Command(lambda ctx, *args: None, "bench")
+    calls = [(Context(message), message.content.split(" ")[1:]) for message in _parsed(bot, lines)]
+
+    def run() -> None:
+        for ctx, arguments in calls:
+            command.call(ctx, arguments)
+
+    return run, len(calls)
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+        "framing": bench_framing,
+        "parse": bench_parse,
+        "construct": bench_construct,
+        "route": bench_route,
+        "command_call": bench_command_call
+        }
+
+
+def time_benchmark(benchmark: Benchmark, lines: List[str], repeat: int) -> Dict[str, float]:
+    run, count = benchmark(lines)
+    run()  # warm up
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        run()
+        best = min(best, time.perf_counter_ns() - start)
+    return {"ns_per_line": best / count}
+
+
+def measure_allocations(lines: List[str]) -> Dict[str, float]:
+    """
+    The memory blocks and bytes still held by each parsed message, and the peak memory used while parsing one.
+
+    The peak includes the temporary lists and strings made while parsing, which are freed again
+    and so do not show up in what the message holds.
+    """
+    bot = _offline_bot()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        messages = _parsed(bot, lines)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    # the snapshot taken before is in the after snapshot as well, leave it out
+    ignore_snapshots = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignore_snapshots).compare_to(before.filter_traces(ignore_snapshots), "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+
+    # starting tracemalloc again resets the peak, so each line is parsed on its own
+    peak_total = 0
+    for line in lines:
+        tracemalloc.start()
+        try:
+            bot.parse_message(line)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_total += peak
+
+    return {
+            "retained_blocks_per_msg": blocks / len(messages),
+            "retained_bytes_per_msg": size / len(messages),
+            "peak_bytes_per_msg": peak_total / len(lines)
+            }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def run_all(corpora: Dict[str, List[str]], repeat: int) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, float]] = {}
+    for corpus_name, lines in corpora.items():
+        for benchmark_name, benchmark in BENCHMARKS.items():
+            results[f"{corpus_name}.{benchmark_name}"] = time_benchmark(benchmark, lines, repeat)
+        results[f"{corpus_name}.allocations"] = measure_allocations(lines)
+
+    return {
+            "meta": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "host": socket.gethostname(),
+                "commit": _git_commit(),
+                "time": time.time()
+                },
+            "results": results
+            }
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> bool:
+    """
+    Print the change of every result, return if any got worse by more than threshold percent.
+    """
+    regressed = False
+    print(f"{'benchmark':<40} {'metric':<24} {'before':>12} {'after':>12} {'change':>9}")
+    for name, metrics in after["results"].items():
+        old_metrics = before["results"].get(name)
+        if old_metrics is None:
+            continue
+
+        for metric, value in metrics.items():
+            old_value = old_metrics.get(metric)
+            if not old_value:
+                continue
+
+            change = (value - old_value) / old_value * 100
+            flag = ""
+            if change > threshold:
+                flag = "  slower" if metric == "ns_per_line" else "  worse"
+                regressed = True
+            print(f"{name:<40} {metric:<24} {old_value:>12.1f} {value:>12.1f} {change:>+8.1f}%{flag}")
+
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="action")
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("-o", "--output", help="write the results to this json file")
+    run_parser.add_argument("--repeat", type=int, default=5, help="take the best of this many passes")
+    run_parser.add_argument("--corpus", action="append", default=[], metavar="NAME=PATH",
+                            help="add a recorded corpus, can be given more than once")
+    run_parser.add_argument("--only", action="append", metavar="NAME", help="only run these corpora")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="percent slower that counts as a regression")
+
+    args = parser.parse_args()
+
+    if args.action == "compare":
+        with open(args.before, encoding="utf8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf8") as f:
+            after = json.load(f)
+        if compare(before, after, args.threshold):
+            sys.exit(1)
+        return
+
+    if args.action != "run":
+        parser.print_help()
+        sys.exit(2)
+
+    corpora = {name: make() for name, make in CORPORA.items() if not args.only or name in args.only}
+    for corpus in args.corpus:
+        name, _, path = corpus.partition("=")
+        corpora[name] = load_corpus(path)
+
+    results = run_all(corpora, args.repeat)
+    for name, metrics in results["results"].items():
+        print(f"{name:<40} " + "  ".join(f"{metric} {value:10.1f}" for metric, value in metrics.items()))
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Startup benchmark, fails if importing the bot or getting it into a channel gets too slow.
+
+Run it from the root of the repo:
+    python benchmarks/startup.py
+
+It checks two things:
+* the time it takes to import PyTwitch and TwitchBot in a new python process
+* the time from starting a new python process until a local server sees the first JOIN
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that should only be imported once they are used
+LAZY_MODULES = ["requests", "PyTwitch.twitch_api", "concurrent.futures.process"]
+
+# TwitchBot is imported by importlib, which -X importtime does not report, so time it in the process it self
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import PyTwitch
+PyTwitch.TwitchBot
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "modules": sorted(sys.modules)}))
+"""
+
+CONNECT_SCRIPT = """
+from PyTwitch import TwitchBot
+bot = TwitchBot()
+bot.connect("bench", "oauth:bench", host="127.0.0.1", port={port})
+bot.join_channel("bench")
+"""
+
+
+def import_time() -> float:
+    """
+    The time in ms spent importing PyTwitch and TwitchBot, measured in a new process.
+    """
+    result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True, cwd=ROOT
+            )
+    measured = json.loads(result.stdout)
+
+    for module in LAZY_MODULES:
+        if module in measured["modules"]:
+            raise AssertionError(f"{module} was imported eagerly")
+
+    elapsed: float = measured["ms"]
+    return elapsed
+
+
+def time_to_first_join() -> float:
+    """
+    The time in ms from starting a new process until it sends its first JOIN.
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", CONNECT_SCRIPT.format(port=port)], cwd=ROOT)
+    try:
+        connection, _ = server.accept()
+        data = b""
+        while b"JOIN" not in data:
+            chunk = connection.recv(2048)
+            if not chunk:
+                raise AssertionError("The bot disconnected before joining")
+            data += chunk
+        elapsed = time.perf_counter() - start
+        connection.close()
+    finally:
+        process.wait()
+        server.close()
+
+    return elapsed * 1000
+
+
+def best_of(runs: int, func: Callable[[], float]) -> float:
+    return min(func() for _ in range(runs))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-budget", type=float, default=50, help="max import time in ms")
+    parser.add_argument("--join-budget", type=float, default=250, help="max time to first JOIN in ms")
+    parser.add_argument("--runs", type=int, default=5, help="the best of this many runs is used")
+    args = parser.parse_args()
+
+    import_ms = best_of(args.runs, import_time)
+    join_ms = best_of(args.runs, time_to_first_join)
+
+    print(f"import time:        {import_ms:8.1f} ms (budget {args.import_budget} ms)")
+    print(f"time to first JOIN: {join_ms:8.1f} ms (budget {args.join_budget} ms)")
+
+    if import_ms > args.import_budget or join_ms > args.join_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
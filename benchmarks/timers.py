@@ -0,0 +1,91 @@
+"""
+Benchmark of the scheduler's timer wheel, showing a tick costs the same with few or many timers waiting.
+
+Run it from the root of the repo:
+    python benchmarks/timers.py --timers 100000
+
+The scheduler runs on a fake clock, so the benchmark does not wait for the timers to be due.
+It reports the cost of adding and cancelling a timer, of a tick with nothing due, and of
+running the timers of a periodic job spread over every channel with jitter.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyTwitch.scheduler import Scheduler, Timer  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _ns_per(start: int, count: int) -> float:
+    return (time.perf_counter_ns() - start) / max(count, 1)
+
+
+def bench(timers: int, resolution: float, ticks: int) -> None:
+    rng = random.Random(1)
+    clock = FakeClock()
+    scheduler = Scheduler(resolution, clock)
+    ran = [0]
+
+    def job() -> None:
+        ran[0] += 1
+
+    # a announcement every 10 minutes in every channel, spread over the first minute
+    start = time.perf_counter_ns()
+    handles: List[Timer] = [scheduler.every(600, job, delay=rng.uniform(0, 60), jitter=5) for _ in range(timers)]
+    print(f"add:            {_ns_per(start, timers):8.0f} ns per timer")
+
+    # ticks while the timers are far away, there is nothing to run
+    clock.now = 60.0 + 5.0
+    scheduler.run_pending()
+    ran[0] = 0
+    start = time.perf_counter_ns()
+    for _ in range(ticks):
+        clock.now += resolution
+        scheduler.run_pending()
+    print(f"idle tick:      {_ns_per(start, ticks):8.0f} ns with {len(scheduler)} timers waiting")
+
+    # one full period, every timer runs once
+    ran[0] = 0
+    start = time.perf_counter_ns()
+    steps = int(600 / resolution)
+    for _ in range(steps):
+        clock.now += resolution
+        scheduler.run_pending()
+    print(f"run:            {_ns_per(start, ran[0]):8.0f} ns per run, {ran[0]} runs over {steps} ticks")
+
+    start = time.perf_counter_ns()
+    for handle in handles:
+        handle.cancel()
+    print(f"cancel:         {_ns_per(start, timers):8.0f} ns per timer")
+
+    # cancelled timers are dropped when their slot comes up
+    for _ in range(steps):
+        clock.now += resolution
+        scheduler.run_pending()
+    print(f"after a period: {len(scheduler)} timers left in the wheel")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timers", type=int, default=100_000, help="timers to schedule")
+    parser.add_argument("--resolution", type=float, default=0.05, help="seconds per tick")
+    parser.add_argument("--ticks", type=int, default=10_000, help="idle ticks to time")
+    args = parser.parse_args()
+
+    bench(args.timers, args.resolution, args.ticks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from PyTwitch import TwitchBot
+
+from secret import TOKEN
+
+BOT_NAME = "therealvivax"
+CHANNEL = "vivax3794"
+
+
+# commands running in a pool need to be defined at the top level
+# and get a snapshot of the context, so they can not use the api.
+def primes(ctx, limit):
+    limit = int(limit)
+    found = [n for n in range(2, limit) if all(n % d for d in range(2, int(n ** 0.5) + 1))]
+    ctx.reply(f"@{ctx.user_name} there are {len(found)} primes below {limit}")
+
+
+if __name__ == "__main__":
+    # worker processes may import this file again, so only connect here.
+    bot = TwitchBot()
+    bot.connect(BOT_NAME, TOKEN)
+    bot.join_channel(CHANNEL)
+
+    bot.process_pool("math", workers=4)
+    bot.command(pool="math")(primes)
+    bot.run()